@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+    routingbench
+    ~~~~~~~~~~~~
+
+    The routing benchmarks of the werkzeug internal benchmark.  They are
+    collected by `wzbench` and run together with the other benchmarks
+    so they can be compared between two Werkzeug versions as well.
+
+    The URL maps are generated with a fixed random seed so that every run
+    uses the same rules.  They are a mix of static rules, rules with
+    `int`, `path` and `any` converters, rules with a trailing slash, rules
+    with defaults, rules for subdomains and rules that only accept some
+    methods.  Each benchmark is available for maps with 10, 100, 1000 and
+    10000 rules.
+
+    The benchmarks without a suffix use the default matcher and `build`
+    and run against all Werkzeug versions that are worth comparing.  The
+    variants with the suffixes ``_trie`` and ``_regex`` use the other
+    matchers, ``_cached`` enables the match cache and ``_builder`` builds
+    the URLs with a function from `make_builder`.  Variants are only
+    created if the loaded Werkzeug version supports them.
+
+    The ``routing_rule_*`` benchmarks measure single operations on a small
+    map: building a static URL and a URL with three variables and matching
+    a rule with four variables.
+
+    :copyright: 2009 by the Werkzeug Team, see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import random
+
+
+#: the number of rules of the generated maps and the names used for them
+#: in the benchmark names.
+MAP_SIZES = [(10, '10'), (100, '100'), (1000, '1k'), (10000, '10k')]
+
+#: the number of operations each benchmark function performs.
+BATCH_SIZE = 50
+
+#: the seed for the map generation.
+SEED = 42
+
+#: the variants of the match benchmarks as ``(suffix, map_options)``.
+MATCH_VARIANTS = [('', {}), ('_trie', {'matcher': 'trie'}),
+                  ('_regex', {'matcher': 'regex'}),
+                  ('_cached', {'match_cache_size': 10000})]
+
+#: the variants of the build benchmarks as ``(suffix, use_builder)``.
+BUILD_VARIANTS = [('', False), ('_builder', True)]
+
+#: the order in which the different kinds of rules are generated.  It's
+#: chosen so that even the smallest map has samples for all benchmarks.
+RULE_KINDS = [0, 5, 3, 7, 1, 8, 4, 6, 9, 2]
+
+SECTIONS = ['blog', 'wiki', 'shop', 'forum', 'news', 'docs', 'users', 'api']
+LANGUAGES = ['en', 'de', 'fr']
+
+
+# the currently used map and the operations of the current benchmark.
+_maps = {}
+_operations = []
+
+
+def generate_rules(size, Rule):
+    """Generate `size` rules and return them together with the URLs and
+    build values for the benchmarks.  The return value is a tuple in the
+    form ``(rules, samples)`` where samples is a dict of lists with the
+    keys ``'hit'``, ``'miss'``, ``'slash'``, ``'defaults'`` and
+    ``'build'``.
+    """
+    rnd = random.Random(SEED)
+    rules = []
+    samples = dict((key, []) for key in ('hit', 'miss', 'slash',
+                                         'defaults', 'build'))
+    i = 0
+    while len(rules) < size:
+        section = '%s%d' % (rnd.choice(SECTIONS), i)
+        endpoint = 'endpoint_%d' % i
+        kind = RULE_KINDS[i % len(RULE_KINDS)]
+        if kind < 3:
+            path = '/%s/%s' % (section, rnd.choice(LANGUAGES))
+            rules.append(Rule(path, endpoint=endpoint))
+            samples['hit'].append(('', path, 'GET'))
+            samples['build'].append((endpoint, {}, None))
+        elif kind == 3:
+            rules.append(Rule('/%s/<int:id>' % section, endpoint=endpoint))
+            samples['hit'].append(('', '/%s/%d' % (section, i), 'GET'))
+            samples['build'].append((endpoint, {'id': i}, None))
+        elif kind == 4:
+            rules.append(Rule('/%s/files/<path:filename>' % section,
+                              endpoint=endpoint))
+            samples['hit'].append(('', '/%s/files/a/b/c.txt' % section,
+                                   'GET'))
+            samples['build'].append((endpoint, {'filename': 'x/y.txt'},
+                                     None))
+        elif kind == 5:
+            rules.append(Rule('/<any(%s):lang>/%s/' % (', '.join(LANGUAGES),
+                              section), endpoint=endpoint))
+            samples['hit'].append(('', '/de/%s/' % section, 'GET'))
+            samples['slash'].append(('', '/fr/%s' % section, 'GET'))
+            samples['build'].append((endpoint, {'lang': 'fr'}, None))
+        elif kind == 6:
+            rules.append(Rule('/%s/' % section, endpoint=endpoint))
+            samples['hit'].append(('', '/%s/' % section, 'GET'))
+            samples['slash'].append(('', '/%s' % section, 'GET'))
+            samples['build'].append((endpoint, {'q': 'x'}, None))
+        elif kind == 7:
+            rules.append(Rule('/%s/' % section, defaults={'page': 1},
+                              endpoint=endpoint))
+            rules.append(Rule('/%s/page/<int:page>' % section,
+                              endpoint=endpoint))
+            samples['hit'].append(('', '/%s/page/2' % section, 'GET'))
+            samples['defaults'].append(('', '/%s/page/1' % section, 'GET'))
+            samples['build'].append((endpoint, {'page': 1}, None))
+            samples['build'].append((endpoint, {'page': 3}, None))
+        elif kind == 8:
+            rules.append(Rule('/%s/edit/<int:id>' % section,
+                              endpoint=endpoint, methods=['POST', 'PUT']))
+            samples['hit'].append(('', '/%s/edit/%d' % (section, i), 'POST'))
+            samples['build'].append((endpoint, {'id': i}, 'POST'))
+        elif rnd.random() < 0.5:
+            rules.append(Rule('/%s/<name>' % section, subdomain='<user>',
+                              endpoint=endpoint))
+            samples['hit'].append(('someone', '/%s/foo' % section, 'GET'))
+            samples['build'].append((endpoint, {'user': 'someone',
+                                                'name': 'foo'}, None))
+        else:
+            rules.append(Rule('/%s/status' % section, subdomain='api',
+                              endpoint=endpoint))
+            samples['hit'].append(('api', '/%s/status' % section, 'GET'))
+            samples['build'].append((endpoint, {}, None))
+        samples['miss'].append(('', '/%s/missing/%d' % (section, i), 'GET'))
+        i += 1
+    return rules, samples
+
+
+def get_map(size, options=None):
+    """Return the map and the samples for the given size and map options.
+    The map is created on first access and reused until Werkzeug is loaded
+    again or another map is requested.
+    """
+    from werkzeug.routing import Map, Rule
+    options = options or {}
+    key = (Map, size, tuple(sorted(options.items())))
+    if key not in _maps:
+        _maps.clear()
+        rules, samples = generate_rules(size, Rule)
+        _maps[key] = Map(rules, default_subdomain='', **options), samples
+    return _maps[key]
+
+
+def supports_map_options(options):
+    """Check if the loaded Werkzeug version supports the map options."""
+    from werkzeug.routing import Map
+    try:
+        Map([], **options)
+    except (TypeError, LookupError):
+        return False
+    return True
+
+
+def supports_builders():
+    """Check if the loaded Werkzeug version has `make_builder`."""
+    from werkzeug.routing import MapAdapter
+    return hasattr(MapAdapter, 'make_builder')
+
+
+def pick(samples, rnd):
+    """Pick `BATCH_SIZE` samples evenly distributed over the map."""
+    if not samples:
+        return []
+    step = max(len(samples) / float(BATCH_SIZE), 1)
+    result = [samples[int(x * step) % len(samples)]
+              for x in xrange(BATCH_SIZE)]
+    rnd.shuffle(result)
+    return result
+
+
+def make_matcher(adapters, subdomain, path, method):
+    """Return a function that matches the URL and ignores routing
+    exceptions.
+    """
+    from werkzeug.exceptions import HTTPException
+    from werkzeug.routing import RequestRedirect
+    adapter = adapters[subdomain]
+    def match():
+        try:
+            adapter.match(path, method)
+        except (HTTPException, RequestRedirect):
+            pass
+    return match
+
+
+def make_builder(adapter, endpoint, values, method, use_builder=False):
+    """Return a function that builds the URL.  If `use_builder` is `True`
+    the URL is built with a function from `make_builder`.
+    """
+    if use_builder:
+        builder = adapter.make_builder(endpoint, method, force_external=True)
+        def build():
+            builder(values)
+    else:
+        def build():
+            adapter.build(endpoint, values, method, force_external=True)
+    return build
+
+
+def setup(size, kind, options=None, use_builder=False):
+    """Set up the operations for a benchmark."""
+    map, samples = get_map(size, options)
+    rnd = random.Random(SEED)
+    adapters = {}
+    for subdomain in '', 'api', 'someone':
+        adapters[subdomain] = map.bind('example.com', '/',
+                                       subdomain=subdomain)
+    if kind == 'build':
+        _operations[:] = [make_builder(adapters[''], *sample + (use_builder,))
+                          for sample in pick(samples[kind], rnd)]
+    else:
+        _operations[:] = [make_matcher(adapters, *sample)
+                          for sample in pick(samples[kind], rnd)]
+    # the first access compiles the rules
+    for operation in _operations:
+        operation()
+
+
+def setup_rule(kind, use_builder=False):
+    """Set up the single operation of a ``routing_rule_*`` benchmark."""
+    from werkzeug.routing import Map, Rule
+    map = Map([
+        Rule('/', endpoint='static'),
+        Rule('/<section>/<int:year>/<slug>', endpoint='three'),
+        Rule('/<lang>/<section>/<int:year>/<slug>', endpoint='four')
+    ])
+    adapter = map.bind('example.com', '/')
+    if kind == 'match':
+        rule = map._rules_by_endpoint['four'][0]
+        def operation():
+            rule.match('|/en/blog/2009/hello')
+    elif kind == 'static':
+        operation = make_builder(adapter, 'static', {}, None, use_builder)
+    else:
+        operation = make_builder(adapter, 'three', {'section': 'blog',
+                                 'year': 2009, 'slug': 'hello'}, None,
+                                 use_builder)
+    operation()
+    _operations[:] = [operation]
+
+
+def teardown():
+    """Forget about the operations of the last benchmark."""
+    del _operations[:]
+
+
+def operations():
+    """Return the single operations of the current benchmark.  These are
+    used to calculate the latency percentiles.
+    """
+    return _operations
+
+
+def make_benchmarks():
+    """Create the `before_`, `time_`, `after_` and `operations_` functions
+    for all benchmarks and map sizes.
+    """
+    rv = {}
+    def add(name, before):
+        def run():
+            for operation in _operations:
+                operation()
+        run.__name__ = 'time_' + name
+        rv['before_' + name] = before
+        rv['time_' + name] = run
+        rv['after_' + name] = teardown
+        rv['operations_' + name] = operations
+
+    match_variants = [(suffix, options) for suffix, options in MATCH_VARIANTS
+                      if supports_map_options(options)]
+    build_variants = [(suffix, use_builder) for suffix, use_builder
+                      in BUILD_VARIANTS if not use_builder or
+                      supports_builders()]
+    for kind, name in [('hit', 'match_hit'), ('miss', 'match_miss'),
+                       ('slash', 'strict_slash_redirect'),
+                       ('defaults', 'defaults_redirect')]:
+        for size, size_name in MAP_SIZES:
+            for suffix, options in match_variants:
+                def before(size=size, kind=kind, options=options):
+                    setup(size, kind, options)
+                add('routing_%s_%s%s' % (name, size_name, suffix), before)
+    for size, size_name in MAP_SIZES:
+        for suffix, use_builder in build_variants:
+            def before(size=size, use_builder=use_builder):
+                setup(size, 'build', use_builder=use_builder)
+            add('routing_build_%s%s' % (size_name, suffix), before)
+
+    add('routing_rule_match_four_vars', lambda: setup_rule('match'))
+    for kind in 'static', 'three_vars':
+        for suffix, use_builder in build_variants:
+            def before(kind=kind, use_builder=use_builder):
+                setup_rule(kind, use_builder)
+            add('routing_rule_build_%s%s' % (kind, suffix), before)
+    return rv
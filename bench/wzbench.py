@@ -20,6 +20,8 @@ from cStringIO import StringIO
 from timeit import default_timer as timer
 from types import FunctionType
 
+import routingbench
+
 
 # create a new module were we later store all the werkzeug attributes.
 wz = type(sys)('werkzeug_nonlazy')
@@ -34,6 +36,10 @@ MIN_RESOLUTION = 0.002
 # we run each test 5 times
 TEST_RUNS = 5
 
+# the latency percentiles calculated for benchmarks with single operations
+PERCENTILES = (50, 90, 99)
+LATENCY_SAMPLES = 1000
+
 
 def find_hg_tag(path):
     """Returns the current node or tag for the given path."""
@@ -109,7 +115,11 @@ def format_func(func):
         name = func
     if name.startswith('time_'):
         name = name[5:]
-    return name.replace('_', ' ').title()
+    name, percentile = (name.split(':', 1) + [None])[:2]
+    name = name.replace('_', ' ').title()
+    if percentile is not None:
+        name += ' %s [us]' % percentile
+    return name
 
 
 def bench(func):
@@ -146,6 +156,44 @@ def bench(func):
 
     return delta
 
+
+def latencies(operations):
+    """Times the operations one by one and returns the `PERCENTILES` of
+    the timings in microseconds as list of ``(percentile, value)`` tuples.
+    """
+    timings = []
+    if not operations:
+        return []
+    gc.collect()
+    gc.disable()
+    try:
+        while len(timings) < LATENCY_SAMPLES:
+            for operation in operations:
+                t = timer()
+                operation()
+                timings.append(timer() - t)
+    finally:
+        gc.enable()
+    timings.sort()
+    result = []
+    for percentile in PERCENTILES:
+        idx = min(len(timings) * percentile // 100, len(timings) - 1)
+        value = timings[int(idx)] * 1000000
+        sys.stdout.write('%44s   %.4f\n' % ('p%d [us]' % percentile, value))
+        result.append(('p%d' % percentile, value))
+    sys.stdout.flush()
+    return result
+
+
+def find_benchmarks():
+    """Returns a dict with the benchmark functions of this module and the
+    ones from the other benchmark modules.
+    """
+    rv = dict((key, value) for key, value in globals().iteritems()
+              if key.split('_', 1)[0] in ('time', 'before', 'after'))
+    rv.update(routingbench.make_benchmarks())
+    return rv
+
 def main():
     """The main entrypoint."""
     from optparse import OptionParser
@@ -156,15 +204,18 @@ def main():
                       default=False, help='compare two hg nodes of Werkzeug')
     parser.add_option('--init-compare', dest='init_compare', action='store_true',
                       default=False, help='Initializes the comparison feature')
+    parser.add_option('--filter', '-f', dest='filter', default=None,
+                      help='only run the benchmarks with this string in '
+                           'the name, e.g. "routing"')
     options, args = parser.parse_args()
     if args:
         parser.error('Script takes no arguments')
     if options.compare:
-        compare(*options.compare)
+        compare(options.compare[0], options.compare[1], options.filter)
     elif options.init_compare:
         init_compare()
     else:
-        run(options.path)
+        run(options.path, filter=options.filter)
 
 
 def init_compare():
@@ -174,7 +225,7 @@ def init_compare():
     subprocess.Popen(['hg', 'clone', '..', 'b']).wait()
 
 
-def compare(node1, node2):
+def compare(node1, node2, filter=None):
     """Compares two Werkzeug hg versions."""
     if not os.path.isdir('a'):
         print >> sys.stderr, 'error: comparision feature not initialized'
@@ -207,8 +258,8 @@ def compare(node1, node2):
 
     _hg_update('a', node1)
     _hg_update('b', node2)
-    d1 = run('a', no_header=True)
-    d2 = run('b', no_header=True)
+    d1 = run('a', no_header=True, filter=filter)
+    d2 = run('b', no_header=True, filter=filter)
 
     print 'DIRECT COMPARISON'.center(80)
     print '-' * 80
@@ -224,7 +275,7 @@ def compare(node1, node2):
     print '-' * 80
 
 
-def run(path, no_header=False):
+def run(path, no_header=False, filter=None):
     path = os.path.abspath(path)
     wz_version, hg_tag = load_werkzeug(path)
     result = {}
@@ -237,13 +288,20 @@ def run(path, no_header=False):
     if hg_tag is not None:
         print 'HG Tag:  %s' % hg_tag
     print '-' * 80
-    for key, value in sorted(globals().items()):
+    benchmarks = find_benchmarks()
+    for key, value in sorted(benchmarks.items()):
         if key.startswith('time_'):
-            before = globals().get('before_' + key[5:])
+            if filter is not None and filter not in key:
+                continue
+            before = benchmarks.get('before_' + key[5:])
             if before:
                 before()
             result[key] = bench(value)
-            after = globals().get('after_' + key[5:])
+            operations = benchmarks.get('operations_' + key[5:])
+            if operations:
+                for percentile, value in latencies(operations()):
+                    result['%s:%s' % (key, percentile)] = value
+            after = benchmarks.get('after_' + key[5:])
             if after:
                 after()
     print '-' * 80
@@ -0,0 +1,45 @@
+from werkzeug import Response, create_environ
+from werkzeug.routing import Map, Rule
+from werkzeug.contrib.jsrouting import generate_map, MapExport
+
+
+def test_generate_map_caching():
+    """JavaScript map generation is cached"""
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/page/<int:page>', endpoint='page'),
+        Rule('/item/<int:id>', endpoint='item')
+    ])
+    source = generate_map(map)
+    assert generate_map(map) is source
+    assert source.count('return value.toString();') == 1
+    assert generate_map(map, 'foo.url_map').startswith(
+        "if (typeof foo === 'undefined') foo = {};\nfoo.url_map = ")
+    map.add(Rule('/about', endpoint='about'))
+    new_source = generate_map(map)
+    assert new_source is not source
+    assert '"about"' in new_source
+
+
+def test_map_export():
+    """Serving the JavaScript map with etags"""
+    map = Map([Rule('/', endpoint='index')])
+    app = MapExport(map, max_age=3600)
+    response = Response.from_app(app, create_environ())
+    assert response.status_code == 200
+    assert response.mimetype == 'text/javascript'
+    assert response.get_etag() == (app.etag, False)
+    assert response.cache_control.max_age == 3600
+    assert response.cache_control.public
+    assert response.data == generate_map(map, 'url_map').encode('utf-8')
+
+    environ = create_environ(headers={'If-None-Match': '"%s"' % app.etag})
+    response = Response.from_app(app, environ)
+    assert response.status_code == 304
+    assert response.data == ''
+
+    etag = app.etag
+    map.add(Rule('/about', endpoint='about'))
+    assert app.etag != etag
+    response = Response.from_app(app, environ)
+    assert response.status_code == 200
@@ -16,6 +16,8 @@ from cStringIO import StringIO
 from werkzeug import Client, Request, Response, parse_form_data, \
      create_environ, FileStorage
 from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import MultiPartParser, SpooledStream, \
+     TemporaryFilePool, default_stream_factory, _make_transfer_decoder
 
 
 def test_parse_form_data_put_without_content():
@@ -269,3 +271,185 @@ def test_limiting():
                               method='POST')
     req.max_form_memory_size = 400
     assert req.form['foo'] == 'Hello World'
+
+
+def test_multipart_large_file():
+    """Test multipart uploads larger than the buffer"""
+    contents = ''.join(['line %d\r\n--fo\r\n--foobar\r\n' % x
+                        for x in xrange(5000)]) + '--foo-\n\r-'
+    data = ('--foo\r\n'
+            'Content-Disposition: form-data; name="foo"; filename="foo.txt"\r\n'
+            '\r\n%s\r\n'
+            '--foo\r\n'
+            'Content-Disposition: form-data; name="bar"\r\n\r\n'
+            'bar\r\n'
+            '--foo--\r\n') % contents
+    req = Request.from_values(input_stream=StringIO(data),
+                              content_length=len(data),
+                              content_type='multipart/form-data; boundary=foo',
+                              method='POST')
+    assert req.files['foo'].read() == contents
+    assert req.form['bar'] == 'bar'
+
+
+def test_incremental_multipart_parser():
+    """Test the incremental multipart parser with tiny chunks"""
+    data = ('\r\n--foo\r\n'
+            'Content-Disposition: form-data; name="foo"\r\n\r\n'
+            'a string\r\n--foo bar\r\n'
+            '--foo\r\n'
+            'Content-Disposition: form-data; name="bar"\r\n\r\n'
+            'another string\r\n'
+            '--foo--\r\n')
+    for size in 1, 2, 7, len(data):
+        parser = MultiPartParser('foo')
+        events = []
+        for pos in xrange(0, len(data), size):
+            events.extend(parser.feed(data[pos:pos + size]))
+        assert parser.finished
+        parser.close()
+        parts = []
+        for event, value in events:
+            if event == 'headers':
+                parts.append([value['content-disposition'], ''])
+            elif event == 'data':
+                parts[-1][1] += value
+        assert parts == [
+            ['form-data; name="foo"', 'a string\r\n--foo bar'],
+            ['form-data; name="bar"', 'another string']
+        ]
+        assert [x[0] for x in events if x[0] != 'data'] == \
+            ['headers', 'end', 'headers', 'end']
+
+    parser = MultiPartParser('foo')
+    parser.feed('--foo\r\nContent-Disposition: form-data; name="foo"\r\n')
+    assert_raises(ValueError, parser.close)
+    assert_raises(ValueError, MultiPartParser('foo').feed, 'foo')
+    assert_raises(ValueError, MultiPartParser, 'foo ')
+
+
+def test_multipart_file_handlers():
+    """Test streaming uploads into file handlers"""
+    from zlib import crc32
+    data = ('--foo\r\n'
+            'Content-Disposition: form-data; name="foo"; filename="foo.txt"\r\n'
+            'Content-Type: text/plain\r\n\r\n'
+            'file contents\r\n'
+            '--foo\r\n'
+            'Content-Disposition: form-data; name="bar"; filename="bar.png"\r\n'
+            'Content-Type: image/png\r\n\r\n'
+            'other contents\r\n'
+            '--foo--')
+    class Checksum(object):
+        def __init__(self, filename, content_type, content_length, headers):
+            if content_type != 'text/plain':
+                raise ValueError('unsupported mimetype')
+            self.filename = filename
+            self.checksum = 0
+        def write(self, data):
+            self.checksum = crc32(data, self.checksum)
+    req = Request.from_values(input_stream=StringIO(data),
+                              content_length=len(data),
+                              content_type='multipart/form-data; boundary=foo',
+                              method='POST')
+    req.file_handlers = {'foo': Checksum}
+    assert req.files['foo'].checksum == crc32('file contents')
+    assert req.files['bar'].read() == 'other contents'
+
+    environ = create_environ(input_stream=StringIO(data),
+                             content_length=len(data),
+                             content_type='multipart/form-data; boundary=foo',
+                             method='POST')
+    handlers = {'foo': Checksum, 'bar': Checksum}
+    assert not parse_form_data(environ, file_handlers=handlers)[2]
+    environ['wsgi.input'] = StringIO(data)
+    assert_raises(ValueError, parse_form_data, environ, silent=False,
+                  file_handlers=handlers)
+
+
+def test_spooled_stream():
+    """Test the spooled streams of the default stream factory"""
+    stream = SpooledStream(10)
+    stream.write('x' * 10)
+    assert not stream.rolled
+    stream.write('y')
+    assert stream.rolled
+    stream.seek(0)
+    assert stream.read() == 'x' * 10 + 'y'
+    stream.close()
+
+    assert default_stream_factory(0, None, None, 1024 * 1024).rolled
+    assert not default_stream_factory(1024 * 1024, None, None).rolled
+
+    pool = TemporaryFilePool(1)
+    stream = SpooledStream(1, pool)
+    stream.write('foo')
+    assert stream.rolled
+    file = stream._file
+    stream.close()
+    stream = SpooledStream(1, pool)
+    stream.write('bar')
+    assert stream._file is file
+    stream.seek(0)
+    assert stream.read() == 'bar'
+    stream.close()
+
+
+def test_multipart_transfer_encoding():
+    """Test decoding of transfer encoded multipart data"""
+    contents = ''.join(chr(x % 256) for x in xrange(1000))
+    encoded = contents.encode('base64')
+    odd = '\r\n'.join(encoded[x:x + 6] for x in xrange(0, len(encoded), 6))
+    for encoding, data in ('base64', encoded), ('base64', odd), \
+                          ('base64', encoded.replace('\n', '')), \
+                          ('quoted-printable', 'foo=3D=\r\nbar\r\nbaz'):
+        result = []
+        write, flush = _make_transfer_decoder(result.append, encoding)
+        for pos in xrange(0, len(data), 7):
+            write(data[pos:pos + 7])
+        flush()
+        assert ''.join(result) == data.decode(encoding)
+
+    data = ('--foo\r\n'
+            'Content-Disposition: form-data; name="foo"; filename="foo.bin"\r\n'
+            'Content-Transfer-Encoding: base64\r\n\r\n'
+            '%s\r\n'
+            '--foo--') % encoded
+    req = Request.from_values(input_stream=StringIO(data),
+                              content_length=len(data),
+                              content_type='multipart/form-data; boundary=foo',
+                              method='POST')
+    assert req.files['foo'].read() == contents
+
+
+def test_form_field_limits():
+    """Test the limits for single form fields and the number of fields"""
+    data = ('--foo\r\nContent-Disposition: form-field; name=foo\r\n\r\n'
+            'Hello World\r\n'
+            '--foo\r\nContent-Disposition: form-field; name=bar\r\n\r\n'
+            'bar=baz\r\n--foo--')
+    def make_request():
+        return Request.from_values(input_stream=StringIO(data),
+                                   content_length=len(data),
+                                   content_type='multipart/form-data; '
+                                   'boundary=foo', method='POST')
+    req = make_request()
+    req.max_form_field_size = 10
+    assert_raises(RequestEntityTooLarge, lambda: req.form['foo'])
+    req = make_request()
+    req.max_form_field_size = 11
+    assert req.form['foo'] == 'Hello World'
+    req = make_request()
+    req.max_form_parts = 1
+    assert_raises(RequestEntityTooLarge, lambda: req.form['foo'])
+    req = make_request()
+    req.max_form_parts = 2
+    assert req.form['bar'] == 'bar=baz'
+
+    data = 'foo=Hello+World&bar=baz'
+    req = Request.from_values(input_stream=StringIO(data),
+                              content_length=len(data),
+                              content_type='application/x-www-form-urlencoded',
+                              method='POST')
+    req.max_form_parts = 1
+    assert_raises(RequestEntityTooLarge, lambda: req.form['foo'])
@@ -11,6 +11,7 @@ from nose.tools import assert_raises
 
 from werkzeug.http import *
 from werkzeug.utils import http_date, redirect
+from werkzeug.test import create_environ
 from werkzeug.datastructures import *
 
 
@@ -177,6 +178,66 @@ def test_etags():
     assert sorted(es.to_header().split(', ')) == ['"bar"', '"blar"', '"foo"', 'w/"baz"']
 
 
+def test_range_header():
+    """Range header parsing"""
+    rv = parse_range_header('bytes=0-499, 500-, -500')
+    assert rv.units == 'bytes'
+    assert rv.ranges == [(0, 500), (500, None), (-500, None)]
+    assert rv.ranges_for_length(1000) == [(0, 1000)]
+    assert rv.to_header() == 'bytes=0-499,500-,-500'
+    rv = parse_range_header('bytes=500-599, 0-9, 5-19, 20-29, 700-')
+    assert rv.ranges_for_length(1000) == [(0, 30), (500, 600), (700, 1000)]
+    assert parse_range_header('bytes=0-99999').ranges_for_length(1000) \
+        == [(0, 1000)]
+    assert parse_range_header('bytes=1000-').ranges_for_length(1000) == []
+    assert parse_range_header('bytes=500-100') is None
+    assert parse_range_header('bytes=foo') is None
+    assert parse_range_header('bytes=-0').ranges == [(0, 0)]
+    assert parse_range_header('bytes=-0').ranges_for_length(1000) == []
+    assert parse_range_header('bytes=-0').to_header() == 'bytes=-0'
+    assert parse_range_header(None) is None
+
+    rv = parse_if_range_header('"foo"')
+    assert rv.etag == 'foo'
+    assert rv.date is None
+    assert not rv.weak
+    rv = parse_if_range_header('W/"foo"')
+    assert rv.etag == 'foo'
+    assert rv.weak
+    assert rv.to_header() == 'w/"foo"'
+    rv = parse_if_range_header('Sun, 06 Nov 1994 08:49:37 GMT')
+    assert rv.etag is None
+    assert rv.date == datetime(1994, 11, 6, 8, 49, 37)
+
+
+def test_get_requested_ranges():
+    """Requested byte ranges"""
+    env = create_environ(headers={'Range': 'bytes=0-9'})
+    assert get_requested_ranges(env, 100) == [(0, 10)]
+    env['HTTP_IF_RANGE'] = '"foo"'
+    assert get_requested_ranges(env, 100, etag='"foo"') == [(0, 10)]
+    assert get_requested_ranges(env, 100, etag='"bar"') is None
+    env['HTTP_IF_RANGE'] = 'W/"foo"'
+    assert get_requested_ranges(env, 100, etag='"foo"') is None
+    env['HTTP_IF_RANGE'] = 'Sun, 06 Nov 1994 08:49:37 GMT'
+    assert get_requested_ranges(env, 100, last_modified=
+                                datetime(1994, 11, 6, 8, 49, 37)) == [(0, 10)]
+    assert get_requested_ranges(env, 100, last_modified=
+                                datetime(1995, 1, 1)) is None
+    assert get_requested_ranges(env, 100, last_modified=
+                                datetime(1994, 1, 1)) is None
+    env = create_environ(method='POST', headers={'Range': 'bytes=0-9'})
+    assert get_requested_ranges(env, 100) is None
+    env = create_environ(headers={'Range': 'bytes=200-'})
+    assert get_requested_ranges(env, 100) == []
+    env = create_environ(headers={'Range': 'bytes=-0'})
+    assert get_requested_ranges(env, 100) == []
+    env = create_environ(headers={'Range': 'bytes=' + ','.join(
+        '%d-%d' % (x, x) for x in xrange(0, 40, 2))})
+    assert len(get_requested_ranges(env, 100, max_ranges=20)) == 20
+    assert get_requested_ranges(env, 100, max_ranges=19) is None
+
+
 def test_parse_date():
     """Date parsing"""
     assert parse_date('Sun, 06 Nov 1994 08:49:37 GMT    ') == datetime(1994, 11, 6, 8, 49, 37)
@@ -11,7 +11,8 @@ from nose.tools import assert_raises
 
 from werkzeug.wrappers import Response
 from werkzeug.routing import Map, Rule, NotFound, BuildError, RequestRedirect, \
-     RuleTemplate, Submount, EndpointPrefix, Subdomain
+     RuleTemplate, Submount, EndpointPrefix, Subdomain, MethodNotAllowed, \
+     BaseConverter, IntegerConverter, ValidationError
 from werkzeug.test import create_environ
 
 
@@ -308,3 +309,370 @@ def test_rule_templates():
         , ('/blah', 'meh', 'x_bar')
         , ('/meh', 'meh', 'x_baz') ]
     )
+
+
+def test_trie_matcher():
+    """Trie matcher behaves like the linear matcher"""
+    def make_map(matcher):
+        return Map([
+            Rule('/', endpoint='index'),
+            Rule('/foo', endpoint='foo'),
+            Rule('/bar/', endpoint='bar'),
+            Rule('/bar/<int:id>', endpoint='bar_show'),
+            Rule('/bar/<int:id>/edit', endpoint='bar_edit', methods=['POST']),
+            Rule('/Talk:<path:name>', endpoint='talk'),
+            Rule('/wiki/<path:name>', endpoint='page'),
+            Rule('/', endpoint='kb_index', subdomain='kb'),
+            Rule('/profile', endpoint='profile', subdomain='<user>')
+        ], matcher=matcher)
+    linear = make_map('linear').bind('example.org', '/')
+    trie = make_map('trie').bind('example.org', '/')
+
+    for path in '/', '/foo', '/bar/', '/bar/42', '/Talk:Foo/Bar', \
+                '/wiki/some/page':
+        assert trie.match(path) == linear.match(path)
+    assert trie.match('/bar/42') == ('bar_show', {'id': 42})
+    assert trie.match('/wiki/bar/x') == ('page', {'name': 'bar/x'})
+    assert_raises(NotFound, lambda: trie.match('/bar/x'))
+    assert_raises(RequestRedirect, lambda: trie.match('/bar'))
+    assert_raises(MethodNotAllowed, lambda: trie.match('/bar/42/edit'))
+    assert trie.match('/bar/42/edit', 'POST') == ('bar_edit', {'id': 42})
+
+    kb = make_map('trie').bind('example.org', '/', 'kb')
+    assert kb.match('/') == ('kb_index', {})
+    assert kb.match('/profile') == ('profile', {'user': 'kb'})
+    assert_raises(NotFound, lambda: kb.match('/foo'))
+
+    assert_raises(LookupError, lambda: Map(matcher='missing'))
+
+
+def test_regex_matcher():
+    """Combined regular expression matcher"""
+    from werkzeug.routing import RegexMatcher
+    class SmallRegexMatcher(RegexMatcher):
+        max_groups = 3
+    rules = [
+        Rule('/', endpoint='index'),
+        Rule('/page/<int(max=10):page>', endpoint='low_page'),
+        Rule('/page/<int:page>', endpoint='page'),
+        Rule('/page/<int:page>/edit', endpoint='edit', methods=['POST']),
+        Rule('/<any(about, help):name>', endpoint='static'),
+        Rule('/downloads/', endpoint='downloads')
+    ]
+    for matcher in 'regex', SmallRegexMatcher:
+        map = Map([rule.empty() for rule in rules], matcher=matcher)
+        adapter = map.bind('example.org', '/')
+        assert adapter.match('/') == ('index', {})
+        assert adapter.match('/page/5') == ('low_page', {'page': 5})
+        assert adapter.match('/page/42') == ('page', {'page': 42})
+        assert adapter.match('/about') == ('static', {'name': 'about'})
+        assert adapter.match('/page/42/edit', 'POST') == ('edit', {'page': 42})
+        assert_raises(MethodNotAllowed, lambda: adapter.match('/page/42/edit'))
+        assert_raises(RequestRedirect, lambda: adapter.match('/downloads'))
+        assert_raises(NotFound, lambda: adapter.match('/missing'))
+
+
+def test_match_cache():
+    """URL routing match cache"""
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/foo/', endpoint='foo'),
+        Rule('/bar/<int:id>', endpoint='bar', methods=['GET'])
+    ], match_cache_size=2)
+    adapter = map.bind('example.org', '/')
+    cache = map.match_cache
+    assert adapter.match('/bar/42') == ('bar', {'id': 42})
+    values = adapter.match('/bar/42')[1]
+    values['id'] = 23
+    assert adapter.match('/bar/42') == ('bar', {'id': 42})
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    for x in xrange(2):
+        assert_raises(RequestRedirect, lambda: adapter.match('/foo'))
+        assert_raises(NotFound, lambda: adapter.match('/missing'))
+        assert_raises(MethodNotAllowed, lambda: adapter.match('/bar/1', 'POST'))
+    assert len(cache) <= 2
+
+    map.add(Rule('/missing', endpoint='missing'))
+    assert len(cache) == 0
+    assert adapter.match('/missing') == ('missing', {})
+
+
+def test_build_query_arguments():
+    """URL building with extra query arguments"""
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/page/<int(max=10):page>', endpoint='page'),
+        Rule('/Talk:<name>', endpoint='talk')
+    ], sort_parameters=True)
+    adapter = map.bind('example.org', '/app')
+    assert adapter.build('page', {'page': 5}) == '/app/page/5'
+    assert adapter.build('page', {'page': 5, 'q': u'\xfc', 'a': 1}) == \
+        '/app/page/5?a=1&q=%C3%BC'
+    assert adapter.build('talk', {'name': 'Foo'}) == 'Talk:Foo'
+    adapter = map.bind('example.org', '/app/../other')
+    assert adapter.build('page', {'page': 5}) == '/other/page/5'
+
+
+def test_make_builder():
+    """URL builder functions and bulk building"""
+    map = Map([
+        Rule('/all/', defaults={'page': 1}, endpoint='all'),
+        Rule('/all/page/<int:page>', endpoint='all'),
+        Rule('/user/<name>', endpoint='user', subdomain='users'),
+        Rule('/upload', endpoint='upload', methods=['POST'])
+    ])
+    adapter = map.bind('example.org', '/app')
+    build = adapter.make_builder('all')
+    assert build({'page': 1}) == '/app/all/'
+    assert build({'page': 2, 'q': 'x'}) == '/app/all/page/2?q=x'
+    assert build({'page': None}) == '/app/all/'
+    assert list(adapter.build_many('all', [{'page': x} for x in 1, 2, 3])) == \
+        ['/app/all/', '/app/all/page/2', '/app/all/page/3']
+    assert list(adapter.build_many('user', [{'name': 'foo'}])) == \
+        ['http://users.example.org/app/user/foo']
+    build = adapter.make_builder('all', force_external=True)
+    assert build({'page': 2}) == 'http://example.org/app/all/page/2'
+    assert_raises(BuildError, lambda: adapter.make_builder('upload')({}))
+    assert adapter.make_builder('upload', 'POST')() == '/app/upload'
+
+
+def test_map_saving():
+    """Saving and loading of compiled maps"""
+    import os
+    import shutil
+    from tempfile import mkdtemp
+    def make_map():
+        calls.append(1)
+        return Map([
+            Rule('/', endpoint='index'),
+            Rule('/page/<int:page>', endpoint='page'),
+            Rule('/<any(about, help):name>', endpoint='static')
+        ], matcher='regex', match_cache_size=10)
+    calls = []
+    tmp = mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'urls')
+        assert Map.load(filename, 'v1') is None
+        map = Map.load(filename, 'v1', make_map)
+        assert map.bind('localhost').match('/page/1') == ('page', {'page': 1})
+        map = Map.load(filename, 'v1', make_map)
+        assert len(calls) == 1
+        assert not map._remap
+        adapter = map.bind('localhost')
+        assert adapter.match('/page/42') == ('page', {'page': 42})
+        assert adapter.match('/help') == ('static', {'name': 'help'})
+        assert adapter.build('page', {'page': 23}) == '/page/23'
+        assert map.match_cache.misses == 2
+
+        assert Map.load(filename, 'v2') is None
+        Map.load(filename, 'v2', make_map)
+        assert len(calls) == 2
+        assert Map.load(filename, 'v2') is not None
+
+        f = file(filename, 'wb')
+        f.write('garbage')
+        f.close()
+        assert Map.load(filename, 'v2') is None
+
+        # maps that cannot be pickled are not saved and leave no
+        # temporary files behind
+        os.remove(filename)
+        def make_unpicklable_map():
+            return Map([Rule('/', endpoint='index')],
+                       sort_key=lambda x: x)
+        map = Map.load(filename, 'v3', make_unpicklable_map)
+        assert map.bind('localhost').match('/') == ('index', {})
+        assert os.listdir(tmp) == []
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_rule_buckets():
+    """Rules are only matched for their subdomains and methods"""
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/', endpoint='kb_index', subdomain='kb'),
+        Rule('/profile', endpoint='profile', subdomain='<user>'),
+        Rule('/entry/<int:id>', endpoint='show', methods=['GET']),
+        Rule('/entry/<int:id>', endpoint='update', methods=['POST', 'PUT']),
+        Rule('/entries/', endpoint='entries', methods=['GET'])
+    ], default_subdomain='www')
+    assert map.bind('example.org').match('/') == ('index', {})
+    assert map.bind('example.org', subdomain='kb').match('/') == \
+        ('kb_index', {})
+    assert map.bind('example.org', subdomain='joe').match('/profile') == \
+        ('profile', {'user': 'joe'})
+    assert_raises(NotFound, lambda: map.bind('example.org',
+                                             subdomain='joe').match('/'))
+
+    adapter = map.bind('example.org')
+    assert adapter.match('/entry/1') == ('show', {'id': 1})
+    assert adapter.match('/entry/1', 'PUT') == ('update', {'id': 1})
+    try:
+        adapter.match('/entry/1', 'DELETE')
+    except MethodNotAllowed, e:
+        assert sorted(e.valid_methods) == ['GET', 'POST', 'PUT']
+    else:
+        raise AssertionError('expected method not allowed exception')
+    assert_raises(RequestRedirect, lambda: adapter.match('/entries', 'POST'))
+    assert_raises(NotFound, lambda: adapter.match('/entry/x', 'DELETE'))
+
+    matcher = map._get_matcher('www', 'POST')
+    assert [x.endpoint for x in matcher.rules] == ['profile', 'update', 'index']
+    assert map._get_matcher('joe', 'DELETE') is map._get_matcher('x', 'FOO')
+
+
+def test_defaults_redirects():
+    """Redirects to rules providing defaults"""
+    map = Map([
+        Rule('/<lang>/', defaults={'page': 1}, endpoint='index',
+             methods=['GET']),
+        Rule('/<lang>/<int:page>', endpoint='index'),
+        Rule('/<lang>/all', defaults={'page': 0}, endpoint='index')
+    ])
+    adapter = map.bind('example.org', '/')
+    assert adapter.match('/en/2') == ('index', {'lang': 'en', 'page': 2})
+    try:
+        adapter.match('/en/0')
+    except RequestRedirect, e:
+        assert e.new_url == 'http://example.org/en/all'
+    else:
+        raise AssertionError('expected request redirect exception')
+    try:
+        adapter.match('/de/1', 'GET')
+    except RequestRedirect, e:
+        assert e.new_url == 'http://example.org/de/'
+    else:
+        raise AssertionError('expected request redirect exception')
+    assert adapter.match('/de/1', 'POST') == ('index', {'lang': 'de',
+                                                        'page': 1})
+    rule = adapter.match('/en/2', return_rule=True)[0]
+    assert sorted(x[0].rule for x in rule._default_providers) == \
+        ['/<lang>/', '/<lang>/all']
+
+
+def test_adding_rules():
+    """Adding rules to a map that was already used"""
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/<page>', endpoint='page'),
+        Rule('/<page>/edit', endpoint='edit_page', methods=['POST'])
+    ])
+    adapter = map.bind('example.org', '/')
+    assert adapter.match('/about') == ('page', {'page': 'about'})
+    assert adapter.build('page', {'page': 'x', 'q': 1}) == '/x?q=1'
+    map.add(Rule('/about', endpoint='about'))
+    map.add(Rule('/<page>/<int:q>', endpoint='page'))
+    map.add(Rule('/<page>', endpoint='page', subdomain='wiki'))
+    assert adapter.match('/about') == ('about', {})
+    assert adapter.match('/about', 'POST') == ('about', {})
+    assert adapter.match('/foo/edit', 'POST') == \
+        ('edit_page', {'page': 'foo'})
+    assert adapter.build('page', {'page': 'x', 'q': 1}) == '/x/1'
+    assert [x.rule for x in map.iter_rules()] == [
+        '/', '/<page>', '/<page>/edit', '/about', '/<page>/<int:q>', '/<page>']
+    assert map.bind('example.org', '/', 'wiki').match('/foo') == \
+        ('page', {'page': 'foo'})
+
+
+def test_build_only_rules_after_defaults():
+    """Build only rules do not outrank rules providing defaults"""
+    map = Map([
+        Rule('/<int:v0>/<int:v1>', endpoint='e0'),
+        Rule('/<int:v0>/x', endpoint='e0', defaults={'d': 1}),
+        Rule('/<any(a, b):v0>', endpoint='e0', build_only=True,
+             defaults={'d': 2})
+    ])
+    assert map.bind('h').build('e0', {'v0': 1}) == '/1/x'
+    map = Map([
+        Rule('/<any(a, b):v0>', endpoint='e0', build_only=True,
+             defaults={'d': 2}),
+        Rule('/<int:v0>/x', endpoint='e0', defaults={'d': 1})
+    ])
+    assert map.bind('h').build('e0', {'v0': 1}) == '/1/x'
+
+    # without defaults build only rules are ordered like the other rules
+    map = Map([Rule('/old', endpoint='x'),
+               Rule('/new', endpoint='x', build_only=True)])
+    assert map.bind('h').build('x') == '/new'
+    map = Map([Rule('/o/<int:a>', endpoint='x'),
+               Rule('/n/<int:a>', endpoint='x', build_only=True)])
+    assert map.bind('h').build('x', {'a': 1}) == '/n/1'
+
+
+def test_converter_conversions():
+    """Simple conversions and cached converters"""
+    calls = []
+    class SlugConverter(BaseConverter):
+        python_cache_size = 2
+        def to_python(self, value):
+            calls.append(value)
+            if value == 'missing':
+                raise ValidationError()
+            return value.upper()
+    class EvenConverter(IntegerConverter):
+        def to_python(self, value):
+            value = int(value)
+            if value % 2:
+                raise ValidationError()
+            return value
+
+    map = Map([
+        Rule('/<slug:slug>/<int:page>/<even:x>', endpoint='slug'),
+        Rule('/<path:path>', endpoint='path')
+    ], converters={'slug': SlugConverter, 'even': EvenConverter})
+    adapter = map.bind('example.org', '/')
+    assert map.converters['default'](map).get_simple_conversion() is unicode
+    assert map.converters['int'](map).get_simple_conversion() is int
+    assert map.converters['int'](map, max=5).get_simple_conversion() is None
+    assert SlugConverter(map).get_simple_conversion() is None
+    assert EvenConverter(map).get_simple_conversion() is None
+
+    assert adapter.match('/foo/1/2') == ('slug', {'slug': 'FOO', 'page': 1,
+                                                  'x': 2})
+    assert adapter.match('/foo/2/2') == ('slug', {'slug': 'FOO', 'page': 2,
+                                                  'x': 2})
+    assert adapter.match('/foo/1/3') == ('path', {'path': 'foo/1/3'})
+    assert adapter.match('/missing/1/2') == ('path', {'path': 'missing/1/2'})
+    assert adapter.match('/missing/1/4') == ('path', {'path': 'missing/1/4'})
+    assert calls == ['foo', 'missing']
+
+
+def test_match_stats():
+    """Match statistics"""
+    from cStringIO import StringIO
+    map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/foo/', endpoint='foo'),
+        Rule('/edit', endpoint='edit', methods=['POST']),
+        Rule('/<int:page>', endpoint='page'),
+        Rule('/dead', endpoint='dead')
+    ], match_stats=True)
+    adapter = map.bind('example.org', '/')
+    for path in '/', '/42', '/23', '/23':
+        adapter.match(path)
+    assert_raises(RequestRedirect, adapter.match, '/foo')
+    assert_raises(NotFound, adapter.match, '/missing')
+    assert_raises(MethodNotAllowed, adapter.match, '/edit')
+    assert_raises(ValueError, map.match_stats.get_rule_stats, 'foo')
+
+    stats = map.match_stats
+    assert (stats.not_found, stats.method_not_allowed, stats.redirects) == \
+        (1, 1, 1)
+    rules = [(rule.rule, hits, scanned) for rule, hits, scanned, elapsed
+             in stats.get_rule_stats('hits')]
+    assert rules[:2] == [('/<int:page>', 3, 2), ('/', 1, 3)]
+    assert sorted(rules[2:]) == [('/dead', 0, 0), ('/edit', 0, 0),
+                                 ('/foo/', 0, 0)]
+    assert [x[0].rule for x in stats.get_rule_stats('rule')] == \
+        ['/', '/foo/', '/edit', '/<int:page>', '/dead']
+
+    out = StringIO()
+    stats.dump(out)
+    assert "<Rule '/<page>' -> page>" in out.getvalue()
+    assert 'not found: 1, method not allowed: 1, redirects: 1' in \
+        out.getvalue()
+    stats.reset()
+    assert stats.not_found == 0
+    assert stats.get_rule_stats()[0][1] == 0
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    werkzeug.serving test
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Tests the development server.
+
+    :copyright: (c) 2009 by the Werkzeug Team, see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import httplib
+from threading import Thread
+from tempfile import mkstemp
+
+from werkzeug import serving
+from werkzeug.wrappers import Request, Response
+
+
+def test_sendfile():
+    """Files are sent with sendfile by the development server"""
+    calls = []
+    def fake_sendfile(out_fd, in_fd, offset, count):
+        calls.append((offset, count))
+        os.lseek(in_fd, offset, 0)
+        return os.write(out_fd, os.read(in_fd, min(count, 7)))
+
+    fd, filename = mkstemp()
+    os.write(fd, '0123456789' * 100)
+    os.close(fd)
+
+    def app(environ, start_response):
+        request = Request(environ)
+        response = Response(open(filename, 'rb'), mimetype='text/plain')
+        if request.args.get('length'):
+            response.headers['Content-Length'] = request.args['length']
+        return response.make_partial(request)(environ, start_response)
+
+    old_sendfile = serving.sendfile
+    serving.sendfile = fake_sendfile
+    server = serving.make_server('127.0.0.1', 0, app)
+    def get(url, **headers):
+        thread = Thread(target=server.handle_request)
+        thread.start()
+        con = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        con.request('GET', url, headers=headers)
+        response = con.getresponse()
+        rv = response.status, response.read()
+        con.close()
+        thread.join()
+        return rv
+    try:
+        assert get('/') == (200, '0123456789' * 100)
+        assert calls[0] == (0, 1000)
+        del calls[:]
+
+        assert get('/', Range='bytes=13-41') == (206, ('0123456789' * 5)[13:42])
+        assert calls[0] == (13, 29)
+        del calls[:]
+
+        assert get('/?length=foo') == (200, '0123456789' * 100)
+        assert calls[0] == (0, 1000)
+    finally:
+        serving.sendfile = old_sendfile
+        server.server_close()
+        os.remove(filename)
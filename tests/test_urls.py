@@ -9,9 +9,11 @@
     :license: BSD, see LICENSE for more details.
 """
 from nose.tools import assert_raises
+from cStringIO import StringIO
 from werkzeug import url_quote, url_unquote, url_quote_plus, \
-     url_unquote_plus, url_encode, url_decode, url_fix, uri_to_iri, \
-     iri_to_uri
+     url_unquote_plus, url_encode, url_decode, url_decode_stream, url_fix, \
+     uri_to_iri, iri_to_uri
+from werkzeug.exceptions import RequestEntityTooLarge
 
 
 def test_quoting():
@@ -41,6 +43,22 @@ def test_url_decoding():
     assert x[u'Üh'] == u'Hänsel'
 
 
+def test_streamed_url_decoding():
+    """Test the URL decoding from streams"""
+    data = 'foo=42&bar=23&uni=H%C3%A4nsel&&' + 'x' * 20 + '=a+b'
+    for buffer_size in 1, 2, 5, 100:
+        x = url_decode_stream(StringIO(data), limit=len(data),
+                              buffer_size=buffer_size)
+        assert x['foo'] == '42'
+        assert x['bar'] == '23'
+        assert x['uni'] == u'Hänsel'
+        assert x['x' * 20] == 'a b'
+        assert len(x) == 4
+    assert_raises(TypeError, url_decode_stream, StringIO(data))
+    assert_raises(RequestEntityTooLarge, url_decode_stream, StringIO(data),
+                  limit=len(data), max_pairs=3)
+
+
 def test_url_encoding():
     """Test the URL decoding"""
     assert url_encode({'foo': 'bar 45'}) == 'foo=bar+45'
@@ -14,9 +14,9 @@ from nose.tools import assert_raises
 
 from datetime import datetime, timedelta
 from werkzeug.wrappers import *
-from werkzeug.wsgi import LimitedStream
+from werkzeug.wsgi import LimitedStream, FileWrapper
 from werkzeug.utils import MultiDict
-from werkzeug.test import Client, create_environ
+from werkzeug.test import Client, create_environ, run_wsgi_app
 
 
 class RequestTestResponse(BaseResponse):
@@ -360,6 +360,44 @@ def test_response_streamed():
     assert r.is_streamed
 
 
+def test_response_file_wrapping():
+    """Test that file responses are passed to the file wrapper"""
+    class MyFileWrapper(FileWrapper):
+        pass
+    env = create_environ()
+    env['wsgi.file_wrapper'] = MyFileWrapper
+    app_iter, status, headers = run_wsgi_app(Response(StringIO('foo')), env)
+    assert isinstance(app_iter, MyFileWrapper)
+    assert ''.join(app_iter) == 'foo'
+    app_iter = run_wsgi_app(Response(['foo']), env)[0]
+    assert not isinstance(app_iter, MyFileWrapper)
+
+
+def test_response_make_partial():
+    """Partial file responses"""
+    response = Response(StringIO('0123456789'))
+    response.headers['Content-Length'] = '10'
+    env = create_environ(headers={'Range': 'bytes=-3'})
+    response.make_partial(env)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 7-9/10'
+    assert response.headers['Content-Length'] == '3'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    app_iter, status, headers = run_wsgi_app(response, env)
+    assert ''.join(app_iter) == '789'
+
+    response = Response(StringIO('0123456789'))
+    response.make_partial(create_environ(headers={'Range': 'bytes=10-'}),
+                          length=10)
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10'
+
+    response = Response('0123456789')
+    response.make_partial(create_environ(headers={'Range': 'bytes=0-1'}))
+    assert response.status_code == 200
+    assert response.data == '0123456789'
+
+
 def test_response_freeze():
     """Response freezing"""
     def generate():
@@ -8,7 +8,7 @@
     :copyright: (c) 2009 by the Werkzeug Team, see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
-from os import path
+from os import path, remove, listdir
 from cStringIO import StringIO
 
 from nose.tools import assert_raises
@@ -51,6 +51,303 @@ def test_shared_data_middleware():
     assert ''.join(app_iter).strip() == 'NOT FOUND'
 
 
+def test_shared_data_middleware_nested_exports():
+    """Shared data middleware with nested exports"""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    def null_application(environ, start_response):
+        start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+        yield 'NOT FOUND'
+    folder = mkdtemp()
+    try:
+        open(path.join(folder, 'test.txt'), 'w').write('NESTED')
+        open(path.join(folder, 'extra.txt'), 'w').write('EXTRA')
+        res = path.join(path.dirname(__file__), 'res')
+        app = SharedDataMiddleware(null_application, {
+            '/':                        path.dirname(folder),
+            '/' + path.basename(folder): res,
+            '/static':                  res,
+            '/static/nested':           folder,
+            '/static/nested/':          folder
+        })
+        for p, expected in [('/static/test.txt', 'FOUND'),
+                            ('/static/nested/test.txt', 'NESTED'),
+                            ('/static/nested/extra.txt', 'EXTRA'),
+                            ('/%s/test.txt' % path.basename(folder), 'FOUND'),
+                            ('/%s/extra.txt' % path.basename(folder), 'EXTRA'),
+                            ('/other/test.txt', 'NOT FOUND')]:
+            app_iter, status, headers = run_wsgi_app(app, create_environ(p))
+            assert ''.join(app_iter).strip() == expected
+    finally:
+        rmtree(folder)
+
+
+def test_shared_data_middleware_metadata_cache():
+    """Shared data middleware with metadata cache"""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    def null_application(environ, start_response):
+        start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+        yield 'NOT FOUND'
+    folder = mkdtemp()
+    try:
+        filename = path.join(folder, 'test.txt')
+        open(filename, 'w').write('FOUND')
+        app = SharedDataMiddleware(null_application, {'/': folder},
+                                   metadata_cache_timeout=60)
+        environ = create_environ('/test.txt')
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert ''.join(app_iter) == 'FOUND'
+        assert '/test.txt' in app._metadata_cache
+        etag = dict(headers)['Etag']
+
+        environ = create_environ('/test.txt',
+                                 headers={'If-None-Match': etag})
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert status == '304 Not Modified'
+
+        open(filename, 'w').write('FOUND AGAIN')
+        environ = create_environ('/test.txt')
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert ''.join(app_iter) == 'FOUND AGAIN'
+        assert dict(headers)['Content-Length'] == '11'
+
+        # whether there is a precompressed file is cached separately.  A
+        # file appearing later adds the vary header once that check expires
+        # even if the file itself did not change.
+        app.gzip = True
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert 'Vary' not in dict(headers)
+        open(filename + '.gz', 'w').write('COMPRESSED')
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert 'Vary' not in dict(headers)
+        key = ('/test.txt', 'gzip')
+        app._metadata_cache[key] = (0,) + app._metadata_cache[key][1:]
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert ''.join(app_iter) == 'FOUND AGAIN'
+        assert dict(headers)['Vary'] == 'Accept-Encoding'
+        remove(filename + '.gz')
+
+        remove(filename)
+        environ = create_environ('/test.txt')
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        assert status == '404 NOT FOUND'
+        assert '/test.txt' not in app._metadata_cache
+
+        # the cache is limited, expired entries are removed first
+        app.gzip = False
+        app.metadata_cache_size = 8
+        app._metadata_cache.clear()
+        for x in xrange(20):
+            open(path.join(folder, '%d.txt' % x), 'w').write('FOUND')
+            app_iter, status, headers = run_wsgi_app(app,
+                create_environ('/%d.txt' % x))
+            assert ''.join(app_iter) == 'FOUND'
+            assert len(app._metadata_cache) <= 8
+        assert '/19.txt' in app._metadata_cache
+        for key in app._metadata_cache.keys():
+            app._metadata_cache[key] = (0,) + app._metadata_cache[key][1:]
+        run_wsgi_app(app, create_environ('/0.txt'))
+        assert app._metadata_cache.keys() == ['/0.txt']
+    finally:
+        rmtree(folder)
+
+
+def test_shared_data_middleware_ranges():
+    """Shared data middleware with range requests"""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    folder = mkdtemp()
+    try:
+        open(path.join(folder, 'test.txt'), 'w').write('0123456789')
+        app = SharedDataMiddleware(None, {'/': folder})
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=2-4'}))
+        headers = dict(headers)
+        assert status == '206 Partial Content'
+        assert ''.join(app_iter) == '234'
+        assert headers['Content-Range'] == 'bytes 2-4/10'
+        assert headers['Content-Length'] == '3'
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=0-1,-2'}))
+        headers = dict(headers)
+        body = ''.join(app_iter)
+        assert status == '206 Partial Content'
+        assert headers['Content-Type'].startswith('multipart/byteranges')
+        assert headers['Content-Length'] == str(len(body))
+        assert 'Content-Range: bytes 0-1/10\r\n\r\n01\r\n' in body
+        assert 'Content-Range: bytes 8-9/10\r\n\r\n89\r\n' in body
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=20-'}))
+        assert status == '416 Requested Range Not Satisfiable'
+        assert dict(headers)['Content-Range'] == 'bytes */10'
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=2-4',
+                                  'If-Range': '"stale"'}))
+        assert status == '200 OK'
+        assert ''.join(app_iter) == '0123456789'
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=2-4', 'If-Range': 'W/' +
+                                  dict(headers)['Etag']}))
+        assert status == '200 OK'
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=-0'}))
+        assert status == '416 Requested Range Not Satisfiable'
+
+        # overlapping ranges are merged instead of sending the file again
+        # for every range
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers={'Range': 'bytes=' + ','.join(['0-'] * 500)}))
+        assert status == '206 Partial Content'
+        assert ''.join(app_iter) == '0123456789'
+    finally:
+        rmtree(folder)
+
+
+def test_shared_data_middleware_gzip():
+    """Shared data middleware with gzip compressed files"""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from gzip import GzipFile
+    from mimetypes import guess_type
+    folder = mkdtemp()
+    cache_folder = mkdtemp()
+    try:
+        open(path.join(folder, 'test.js'), 'w').write('var x = 42;')
+        open(path.join(folder, 'test.js.gz'), 'w').write('PRECOMPRESSED')
+        open(path.join(folder, 'test.css'), 'w').write('body { }' * 100)
+        open(path.join(folder, 'test.png'), 'w').write('PNG')
+        app = SharedDataMiddleware(None, {'/': folder}, gzip=True,
+                                   gzip_cache_dir=cache_folder)
+        gzip_headers = {'Accept-Encoding': 'gzip, deflate'}
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.js', headers=gzip_headers))
+        headers = dict(headers)
+        assert ''.join(app_iter) == 'PRECOMPRESSED'
+        assert headers['Content-Encoding'] == 'gzip'
+        assert headers['Content-Type'] == guess_type('test.js')[0]
+        assert headers['Vary'] == 'Accept-Encoding'
+        gzip_etag = headers['Etag']
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.js', headers={'Accept-Encoding': 'gzip;q=0'}))
+        headers = dict(headers)
+        assert ''.join(app_iter) == 'var x = 42;'
+        assert 'Content-Encoding' not in headers
+        assert headers['Vary'] == 'Accept-Encoding'
+        assert headers['Etag'] != gzip_etag
+
+        for x in xrange(2):
+            app_iter, status, headers = run_wsgi_app(app, create_environ(
+                '/test.css', headers=gzip_headers))
+            headers = dict(headers)
+            body = ''.join(app_iter)
+            assert headers['Content-Encoding'] == 'gzip'
+            assert headers['Content-Length'] == str(len(body))
+            assert headers['Etag'].endswith('-gzip"')
+            assert GzipFile(fileobj=StringIO(body)).read() == 'body { }' * 100
+            assert len(listdir(cache_folder)) == 1
+
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.png', headers=gzip_headers))
+        headers = dict(headers)
+        assert ''.join(app_iter) == 'PNG'
+        assert 'Content-Encoding' not in headers
+        assert 'Vary' not in headers
+
+        # files larger than the cache are not compressed, the file just
+        # compressed is never removed from the cache
+        app.gzip_cache_size = 10
+        open(path.join(folder, 'test.txt'), 'w').write('FOUND' * 10)
+        for x in xrange(2):
+            app_iter, status, headers = run_wsgi_app(app, create_environ(
+                '/test.txt', headers=gzip_headers))
+            assert ''.join(app_iter) == 'FOUND' * 10
+            assert 'Content-Encoding' not in dict(headers)
+            assert 'Vary' not in dict(headers)
+        open(path.join(folder, 'test.txt'), 'w').write('FOUND')
+        app_iter, status, headers = run_wsgi_app(app, create_environ(
+            '/test.txt', headers=gzip_headers))
+        assert GzipFile(fileobj=StringIO(''.join(app_iter))).read() == 'FOUND'
+        assert len(listdir(cache_folder)) == 1
+    finally:
+        rmtree(folder)
+        rmtree(cache_folder)
+
+
+def test_shared_data_middleware_gzip_metadata_cache():
+    """Shared data middleware caches the lookups of compressed files"""
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from gzip import GzipFile
+    folder = mkdtemp()
+    cache_folder = mkdtemp()
+    try:
+        open(path.join(folder, 'test.css'), 'w').write('body { }' * 100)
+        app = SharedDataMiddleware(None, {'/': folder}, gzip=True,
+                                   gzip_cache_dir=cache_folder,
+                                   metadata_cache_timeout=60)
+        writes = []
+        write_compressed_file = app._write_compressed_file
+        def counting_write(f, filename):
+            writes.append(filename)
+            write_compressed_file(f, filename)
+        app._write_compressed_file = counting_write
+        find_file = app._find_file
+        lookups = []
+        def counting_find(path):
+            lookups.append(path)
+            return find_file(path)
+        app._find_file = counting_find
+
+        environ = create_environ('/test.css',
+                                 headers={'Accept-Encoding': 'gzip'})
+        for x in xrange(3):
+            app_iter, status, headers = run_wsgi_app(app, environ)
+            body = ''.join(app_iter)
+            assert dict(headers)['Content-Encoding'] == 'gzip'
+            assert GzipFile(fileobj=StringIO(body)).read() == 'body { }' * 100
+        assert len(writes) == 1
+        assert lookups == ['/test.css.gz', '/test.css']
+        assert app._metadata_cache[('/test.css', 'gzip')][1] == writes[0]
+
+        # the check for a precompressed file is cached as well
+        open(path.join(folder, 'test.png'), 'w').write('PNG')
+        del lookups[:]
+        for x in xrange(3):
+            app_iter, status, headers = run_wsgi_app(app,
+                create_environ('/test.png'))
+            assert ''.join(app_iter) == 'PNG'
+            assert 'Vary' not in dict(headers)
+        assert lookups == ['/test.png', '/test.png.gz']
+
+        # a changed file is compressed again
+        open(path.join(folder, 'test.css'), 'w').write('p { }' * 100)
+        app_iter, status, headers = run_wsgi_app(app, environ)
+        body = ''.join(app_iter)
+        assert GzipFile(fileobj=StringIO(body)).read() == 'p { }' * 100
+        assert len(writes) == 2
+
+        # requests for paths without a file are never cached
+        app.app = BaseResponse('app')
+        cached = set(app._metadata_cache)
+        for x in xrange(50):
+            app_iter, status, headers = run_wsgi_app(app, create_environ(
+                '/missing/%d' % x, headers={'Accept-Encoding': 'gzip'}))
+            assert ''.join(app_iter) == 'app'
+        assert set(app._metadata_cache) == cached
+    finally:
+        rmtree(folder)
+        rmtree(cache_folder)
+
+
 def test_get_host():
     """Host lookup"""
     env = {'HTTP_X_FORWARDED_HOST': 'example.org',
@@ -41,8 +41,8 @@ all_by_module = {
                              'run_wsgi_app'],
     'werkzeug.testapp':     ['test_app'],
     'werkzeug.exceptions':  ['abort', 'Aborter'],
-    'werkzeug.urls':        ['url_decode', 'url_encode', 'url_quote',
-                             'url_quote_plus', 'url_unquote',
+    'werkzeug.urls':        ['url_decode', 'url_decode_stream', 'url_encode',
+                             'url_quote', 'url_quote_plus', 'url_unquote',
                              'url_unquote_plus', 'url_fix', 'Href',
                              'iri_to_uri', 'uri_to_iri'],
     'werkzeug.formparser':  ['parse_form_data'],
@@ -58,7 +58,8 @@ all_by_module = {
                              'peek_path_info', 'SharedDataMiddleware',
                              'DispatcherMiddleware', 'ClosingIterator',
                              'FileWrapper', 'make_line_iter', 'LimitedStream',
-                             'responder', 'wrap_file', 'extract_path_info'],
+                             'responder', 'wrap_file', 'wrap_file_ranges',
+                             'extract_path_info'],
     'werkzeug.datastructures': ['MultiDict', 'CombinedMultiDict', 'Headers',
                              'EnvironHeaders', 'ImmutableList',
                              'ImmutableDict', 'ImmutableMultiDict',
@@ -67,7 +68,8 @@ all_by_module = {
                              'LanguageAccept', 'RequestCacheControl',
                              'ResponseCacheControl', 'ETags', 'HeaderSet',
                              'WWWAuthenticate', 'Authorization',
-                             'FileMultiDict', 'CallbackDict', 'FileStorage'],
+                             'FileMultiDict', 'CallbackDict', 'FileStorage',
+                             'Range', 'IfRange'],
     'werkzeug.useragents':  ['UserAgent'],
     'werkzeug.http':        ['parse_etags', 'parse_date', 'parse_cache_control_header',
                              'is_resource_modified', 'parse_accept_header',
@@ -80,7 +82,9 @@ all_by_module = {
                              'remove_hop_by_hop_headers', 'parse_options_header',
                              'dump_options_header', 'is_hop_by_hop_header',
                              'unquote_header_value',
-                             'quote_header_value', 'HTTP_STATUS_CODES'],
+                             'quote_header_value', 'parse_range_header',
+                             'parse_if_range_header', 'get_requested_ranges',
+                             'HTTP_STATUS_CODES'],
     'werkzeug.wrappers':    ['BaseResponse', 'BaseRequest', 'Request',
                              'Response', 'AcceptMixin', 'ETagRequestMixin',
                              'ETagResponseMixin', 'ResponseStreamMixin',
@@ -6,30 +6,45 @@
     Addon module that allows to create a JavaScript function from a map
     that generates rules.
 
+    The generated code is cached per map and only generated again if rules
+    were added to the map.  :class:`MapExport` serves it as a WSGI
+    application with a strong etag so that browsers can cache it.
+
     :copyright: (c) 2009 by the Werkzeug Team, see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
 try:
-    from simplejson import dumps
+    from simplejson import dumps as _dumps
+    def dumps(obj):
+        return _dumps(obj, separators=(',', ':'))
 except ImportError:
     def dumps(*args):
         raise RuntimeError('simplejson required for jsrouting')
 
 from inspect import getmro
-from werkzeug.templates import Template
+from weakref import WeakKeyDictionary
+from werkzeug.http import generate_etag
+from werkzeug.wrappers import Response
 from werkzeug.routing import NumberConverter
 
 
-_javascript_routing_template = Template(u'''\
-<% if name_parts %>\
-<% for idx in xrange(0, len(name_parts) - 1) %>\
-if (typeof ${'.'.join(name_parts[:idx + 1])} === 'undefined') \
-${'.'.join(name_parts[:idx + 1])} = {};
-<% endfor %>\
-${'.'.join(name_parts)} = <% endif %>\
+# the generated code of the maps by name together with the number of rules
+# that were added to the map when it was generated.
+_map_cache = WeakKeyDictionary()
+
+
+_javascript_routing_template = u'''\
 (function (server_name, script_name, subdomain, url_scheme) {
-    var converters = ${', '.join(converters)};
-    var rules = $rules;
+    var converters = [%(converters)s];
+    var rules = %(rules)s;
+    var rules_by_endpoint = {};
+    for (var i = 0; i < rules.length; i++) {
+        var endpoint = rules[i][0];
+        if (!rules_by_endpoint.hasOwnProperty(endpoint)) {
+            rules_by_endpoint[endpoint] = [];
+        }
+        rules_by_endpoint[endpoint].push(rules[i]);
+    }
     function in_array(array, value) {
         if (array.indexOf != undefined) {
             return array.indexOf(value) != -1;
@@ -62,8 +77,8 @@ ${'.'.join(name_parts)} = <% endif %>\
         return {names: names, values: values, original: obj};
     }
     function suitable(rule, args) {
-        var default_args = split_obj(rule.defaults || {});
-        var diff_arg_names = array_diff(rule.arguments, default_args.names);
+        var default_args = split_obj(rule[3] || {});
+        var diff_arg_names = array_diff(rule[1], default_args.names);
 
         for (var i = 0; i < diff_arg_names.length; i++) {
             if (!in_array(args.names, diff_arg_names[i])) {
@@ -71,8 +86,8 @@ ${'.'.join(name_parts)} = <% endif %>\
             }
         }
 
-        if (array_diff(rule.arguments, args.names).length == 0) {
-            if (rule.defaults == null) {
+        if (array_diff(rule[1], args.names).length == 0) {
+            if (rule[3] == null) {
                 return true;
             }
             for (var i = 0; i < default_args.names.length; i++) {
@@ -88,19 +103,18 @@ ${'.'.join(name_parts)} = <% endif %>\
     }
     function build(rule, args) {
         var tmp = [];
-        var processed = rule.arguments.slice();
-        for (var i = 0; i < rule.trace.length; i++) {
-            var part = rule.trace[i];
-            if (part.is_dynamic) {
-                var converter = converters[rule.converters[part.data]];
-                var data = converter(args.original[part.data]);
+        var processed = rule[1].slice();
+        for (var i = 0; i < rule[2].length; i++) {
+            var part = rule[2][i];
+            if (typeof(part) != 'string') {
+                var data = converters[part[1]](args.original[part[0]]);
                 if (data == null) {
                     return null;
                 }
                 tmp.push(data);
-                processed.push(part.name);
+                processed.push(part[0]);
             } else {
-                tmp.push(part.data);
+                tmp.push(part);
             }
         }
         tmp = tmp.join('');
@@ -138,9 +152,10 @@ ${'.'.join(name_parts)} = <% endif %>\
     return function(endpoint, args, force_external) {
         args = split_obj(args);
         var rv = null;
+        var rules = rules_by_endpoint.hasOwnProperty(endpoint) ?
+                    rules_by_endpoint[endpoint] : [];
         for (var i = 0; i < rules.length; i++) {
             var rule = rules[i];
-            if (rule.endpoint != endpoint) continue;
             if (suitable(rule, args)) {
                 rv = build(rule, args);
                 if (rv != null) {
@@ -160,7 +175,7 @@ ${'.'.join(name_parts)} = <% endif %>\
                    + '/' + lstrip(rv.path, '/');
         }
     };
-})''')
+})'''
 
 
 def generate_map(map, name='url_map'):
@@ -172,6 +187,11 @@ def generate_map(map, name='url_map'):
     script that assigns the function with that name.  Dotted names are
     resolved (so you an use a name like 'obj.url_for')
 
+    The code is cached for the map and only generated again if rules were
+    added to the map since the last call.  The rules only refer to the
+    converter functions they use by their index so that the code stays
+    small even for maps with many rules.
+
     In order to use JavaScript generation, simplejson must be installed.
 
     Note that using this feature will expose the rules
@@ -179,35 +199,58 @@ def generate_map(map, name='url_map'):
     information, don't use JavaScript generation!
     """
     map.update()
+    cache = _map_cache.get(map)
+    if cache is None:
+        cache = _map_cache[map] = {}
+    version, source = cache.get(name, (None, None))
+    if version != map._rule_count:
+        source = _generate_map(map, name)
+        cache[name] = (map._rule_count, source)
+    return source
+
+
+def _generate_map(map, name):
+    """Does the actual code generation for :func:`generate_map`."""
+    endpoints = []
+    seen = set()
+    for rule in map.iter_rules():
+        if rule.endpoint not in seen:
+            seen.add(rule.endpoint)
+            endpoints.append(rule.endpoint)
+
     rules = []
     converters = []
-    for rule in map.iter_rules():
-        trace = [{
-            'is_dynamic':   is_dynamic,
-            'data':         data
-        } for is_dynamic, data in rule._trace]
-        rule_converters = {}
-        for key, converter in rule._converters.iteritems():
-            js_func = js_to_url_function(converter)
-            try:
-                index = converters.index(js_func)
-            except ValueError:
-                converters.append(js_func)
-                index = len(converters) - 1
-            rule_converters[key] = index
-        rules.append({
-            u'endpoint':    rule.endpoint,
-            u'arguments':   list(rule.arguments),
-            u'converters':  rule_converters,
-            u'trace':       trace,
-            u'defaults':    rule.defaults
-        })
-
-    return _javascript_routing_template.render({
-        'name_parts':   name and name.split('.') or [],
-        'rules':        dumps(rules),
-        'converters':   converters
-    })
+    converter_indexes = {}
+    for endpoint in endpoints:
+        # the rules of an endpoint are in the order used for building
+        for rule in map.iter_rules(endpoint):
+            trace = []
+            for is_dynamic, data in rule._trace:
+                if not is_dynamic:
+                    trace.append(data)
+                    continue
+                js_func = js_to_url_function(rule._converters[data])
+                index = converter_indexes.get(js_func)
+                if index is None:
+                    index = converter_indexes[js_func] = len(converters)
+                    converters.append(js_func)
+                trace.append([data, index])
+            rules.append([endpoint, list(rule.arguments), trace,
+                          rule.defaults])
+
+    source = _javascript_routing_template % {
+        'converters':   u', '.join(converters),
+        'rules':        dumps(rules)
+    }
+    if not name:
+        return source
+    name_parts = name.split('.')
+    lines = []
+    for idx in xrange(1, len(name_parts)):
+        part = '.'.join(name_parts[:idx])
+        lines.append(u"if (typeof %s === 'undefined') %s = {};" % (part, part))
+    lines.append(u'%s = %s' % (name, source))
+    return u'\n'.join(lines)
 
 
 def generate_adapter(adapter, name='url_for', map_name='url_map'):
@@ -229,6 +272,64 @@ var %(name)s = %(map_name)s(
 );''' % values
 
 
+class MapExport(object):
+    """A WSGI application that serves the code generated by
+    :func:`generate_map` for a map.  The response has a strong etag that
+    is the hash of the code and is sent with a long max age in the
+    `Cache-Control` header.  Put the :attr:`etag` into the URL of the
+    script so that browsers fetch the code again when rules were added::
+
+        url_map_js = MapExport(url_map)
+
+        def application(environ, start_response):
+            if environ['PATH_INFO'] == '/url_map.js':
+                return url_map_js(environ, start_response)
+            ...
+
+    And in the templates::
+
+        <script src="/url_map.js?v=${url_map_js.etag}"></script>
+
+    :param map: the :class:`~werkzeug.routing.Map` to export.
+    :param name: the name passed to :func:`generate_map`.
+    :param max_age: the number of seconds the code may be cached.  Defaults
+                    to one year.
+    """
+
+    def __init__(self, map, name='url_map', max_age=60 * 60 * 24 * 365):
+        self.map = map
+        self.name = name
+        self.max_age = max_age
+        self._source = None
+        self._data = None
+        self._etag = None
+
+    def get_data(self):
+        """Return the encoded code and the etag as tuple.  The etag is only
+        calculated again if the code changed.
+        """
+        source = generate_map(self.map, self.name)
+        if source is not self._source:
+            data = source.encode('utf-8')
+            self._data, self._etag = data, generate_etag(data)
+            self._source = source
+        return self._data, self._etag
+
+    @property
+    def etag(self):
+        """The etag of the current code."""
+        return self.get_data()[1]
+
+    def __call__(self, environ, start_response):
+        data, etag = self.get_data()
+        response = Response(data, mimetype='text/javascript')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.make_conditional(environ)
+        return response(environ, start_response)
+
+
 def js_to_url_function(converter):
     """Get the JavaScript converter function from a rule."""
     if hasattr(converter, 'js_to_url_function'):
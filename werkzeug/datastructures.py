@@ -1837,6 +1837,103 @@ class ETags(object):
         return '<%s %r>' % (self.__class__.__name__, str(self))
 
 
+class Range(object):
+    """Represents a `Range` header.  The ranges are stored as list of
+    ``(start, stop)`` tuples where `stop` is exclusive and `None` if the
+    range goes up to the end of the resource.  Suffix ranges like ``-500``
+    have a negative `start` and a `stop` of `None`, the empty suffix range
+    ``-0`` is stored as ``(0, 0)``.
+
+    .. versionadded:: 0.6
+    """
+
+    # this class is public
+    __module__ = 'werkzeug'
+
+    def __init__(self, units, ranges):
+        #: the units of the ranges.  Usually ``'bytes'``.
+        self.units = units
+        #: a list of ``(start, stop)`` tuples.
+        self.ranges = ranges
+
+    def ranges_for_length(self, length):
+        """Returns the satisfiable ranges for a resource of the given length
+        as list of ``(start, stop)`` tuples with absolute positions.  The
+        ranges are sorted and overlapping or adjacent ranges are merged so
+        that no byte is sent twice.  If no range is satisfiable the list is
+        empty.
+        """
+        ranges = []
+        for start, stop in self.ranges:
+            if start < 0:
+                start = max(length + start, 0)
+            if stop is None or stop > length:
+                stop = length
+            if start < stop:
+                ranges.append((start, stop))
+        ranges.sort()
+        rv = []
+        for start, stop in ranges:
+            if rv and start <= rv[-1][1]:
+                if stop > rv[-1][1]:
+                    rv[-1] = (rv[-1][0], stop)
+            else:
+                rv.append((start, stop))
+        return rv
+
+    def to_header(self):
+        """Converts the object back into a HTTP header."""
+        ranges = []
+        for start, stop in self.ranges:
+            if stop is None:
+                ranges.append(start >= 0 and '%s-' % start or str(start))
+            elif stop == 0:
+                ranges.append('-0')
+            else:
+                ranges.append('%s-%s' % (start, stop - 1))
+        return '%s=%s' % (self.units, ','.join(ranges))
+
+    def __str__(self):
+        return self.to_header()
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, str(self))
+
+
+class IfRange(object):
+    """Represents an `If-Range` header which holds either an etag or a
+    date.  The attribute that is not used is `None`.
+
+    .. versionadded:: 0.6
+    """
+
+    # this class is public
+    __module__ = 'werkzeug'
+
+    def __init__(self, etag=None, date=None, weak=False):
+        #: the etag parsed and unquoted.
+        self.etag = etag
+        #: the date in parsed format or `None`.
+        self.date = date
+        #: `True` if the etag is weak.  Weak etags never match because
+        #: `If-Range` requires a strong comparison.
+        self.weak = weak
+
+    def to_header(self):
+        """Converts the object back into a HTTP header."""
+        if self.date is not None:
+            return http_date(self.date)
+        if self.etag is not None:
+            return quote_etag(self.etag, self.weak)
+        return ''
+
+    def __str__(self):
+        return self.to_header()
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, str(self))
+
+
 class Authorization(ImmutableDictMixin, dict):
     """Represents an `Authorization` header sent by the client.  You should
     not create this kind of object yourself but use it when it's returned by
@@ -2111,7 +2208,8 @@ class FileStorage(object):
 
 # circular dependencies
 from werkzeug.http import dump_options_header, dump_header, generate_etag, \
-     quote_header_value, parse_set_header, unquote_etag
+     quote_header_value, parse_set_header, unquote_etag, quote_etag
+from werkzeug.utils import http_date
 
 
 # create all the special key errors now that the classes are defined.
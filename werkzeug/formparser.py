@@ -10,16 +10,13 @@
     :license: BSD, see LICENSE for more details.
 """
 import re
+from binascii import a2b_base64, a2b_qp
 from cStringIO import StringIO
 from tempfile import TemporaryFile
-from itertools import chain, repeat
 
 from werkzeug._internal import _decode_unicode, _empty_stream
 
 
-#: an iterator that yields empty strings
-_empty_string_iter = repeat('')
-
 #: a regular expression for multipart boundaries
 _multipart_boundary_re = re.compile('^[ -~]{0,200}[!-~]$')
 
@@ -27,19 +24,144 @@ _multipart_boundary_re = re.compile('^[ -~]{0,200}[!-~]$')
 #: for multipart messages.
 _supported_multipart_encodings = frozenset(['base64', 'quoted-printable'])
 
+#: a translation table that maps every byte to itself, used to strip the
+#: whitespace from base64 data.
+_identity_table = ''.join(map(chr, xrange(256)))
+
 
 def default_stream_factory(total_content_length, filename, content_type,
-                           content_length=None):
-    """The stream factory that is used per default."""
-    if total_content_length > 1024 * 500:
-        return TemporaryFile('wb+')
-    return StringIO()
+                           content_length=None, max_memory_size=1024 * 500,
+                           pool=None):
+    """The stream factory that is used per default.  It returns a
+    :class:`SpooledStream` that keeps the file in memory until it is
+    larger than `max_memory_size` bytes.  If the file is known to be
+    larger than that it goes to a temporary file right away.
+
+    .. versionchanged:: 0.6
+       The decision is made per file and no longer based on the total
+       content length.  The `max_memory_size` and `pool` parameters were
+       added.
+
+    :param max_memory_size: the number of bytes of a file kept in memory.
+    :param pool: an optional :class:`TemporaryFilePool` the temporary
+                 files are taken from.
+    """
+    stream = SpooledStream(max_memory_size, pool)
+    if content_length > max_memory_size:
+        stream.rollover()
+    return stream
+
+
+class TemporaryFilePool(object):
+    """A pool of temporary files used by :class:`SpooledStream`.  The files
+    are created in advance and reused after the stream that used them was
+    closed which saves creating and unlinking a file for every upload.
+    Point `directory` to a tmpfs mount to keep them out of the disk.
+
+    .. versionadded:: 0.6
+
+    :param size: the number of files kept in the pool.
+    :param directory: the directory the files are created in.  If not
+                      given the default temporary directory is used.
+    """
+
+    def __init__(self, size=10, directory=None):
+        self.size = size
+        self.directory = directory
+        self._files = [self._create() for x in xrange(size)]
+
+    def _create(self):
+        return TemporaryFile('wb+', dir=self.directory)
+
+    def get(self):
+        """Returns an empty temporary file.  If the pool is exhausted a new
+        one is created.
+        """
+        try:
+            return self._files.pop()
+        except IndexError:
+            return self._create()
+
+    def release(self, file):
+        """Gives a file back to the pool.  It is truncated, or closed if the
+        pool is already full.
+        """
+        if len(self._files) >= self.size:
+            file.close()
+            return
+        file.seek(0)
+        file.truncate()
+        self._files.append(file)
+
+
+class SpooledStream(object):
+    """A stream that keeps the data in memory until more than
+    `max_memory_size` bytes are written and moves it into a temporary file
+    afterwards.  All the attributes of the underlying file are proxied.
+
+    .. versionadded:: 0.6
+
+    :param max_memory_size: the number of bytes kept in memory.
+    :param pool: an optional :class:`TemporaryFilePool` the temporary file
+                 is taken from and given back to when the stream is closed.
+    """
+
+    def __init__(self, max_memory_size=1024 * 500, pool=None):
+        self.max_memory_size = max_memory_size
+        self.pool = pool
+        self._file = StringIO()
+        self._rolled = False
+
+    @property
+    def rolled(self):
+        """`True` if the data was moved into a temporary file."""
+        return self._rolled
+
+    def rollover(self):
+        """Moves the data into a temporary file."""
+        if self._rolled:
+            return
+        if self.pool is not None:
+            file = self.pool.get()
+        else:
+            file = TemporaryFile('wb+')
+        pos = self._file.tell()
+        file.write(self._file.getvalue())
+        file.seek(pos)
+        self._file = file
+        self._rolled = True
+
+    def write(self, data):
+        if not self._rolled and \
+           self._file.tell() + len(data) > self.max_memory_size:
+            self.rollover()
+        self._file.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        """Closes the stream.  A pooled file is given back to the pool."""
+        file = self._file
+        self._file = _empty_stream
+        if self._rolled and self.pool is not None:
+            self.pool.release(file)
+        elif file is not _empty_stream:
+            file.close()
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
 
 
 def parse_form_data(environ, stream_factory=None, charset='utf-8',
                     errors='ignore', max_form_memory_size=None,
                     max_content_length=None, cls=None,
-                    silent=True):
+                    silent=True, file_handlers=None,
+                    max_form_field_size=None, max_form_parts=None):
     """Parse the form data in the environ and return it as tuple in the form
     ``(stream, form, files)``.  You should only call this method if the
     transport method is `POST` or `PUT`.
@@ -61,6 +183,10 @@ def parse_form_data(environ, stream_factory=None, charset='utf-8',
     .. versionadded:: 0.5.1
        The optional `silent` flag was added.
 
+    .. versionadded:: 0.6
+       The optional `file_handlers`, `max_form_field_size` and
+       `max_form_parts` parameters were added.
+
     :param environ: the WSGI environment to be used for parsing.
     :param stream_factory: An optional callable that returns a new read and
                            writeable file descriptor.  This callable works
@@ -79,6 +205,26 @@ def parse_form_data(environ, stream_factory=None, charset='utf-8',
     :param cls: an optional dict class to use.  If this is not specified
                        or `None` the default :class:`MultiDict` is used.
     :param silent: If set to False parsing errors will not be caught.
+    :param file_handlers: an optional dict that maps the names of file
+                          fields to callables that are invoked instead of
+                          the `stream_factory` for uploads in that field.
+                          They are passed the filename, the mimetype, the
+                          content length and the headers of the part and
+                          have to return an object with a `write()` method
+                          that is fed with the file data while it is
+                          parsed.  If that object has a `seek()` method it
+                          is rewound afterwards.  A handler can reject an
+                          upload by raising an exception.
+    :param max_form_field_size: the maximum number of bytes of a single
+                                multipart form field that is not a file.
+                                If a field is longer an
+                                :exc:`~exceptions.RequestEntityTooLarge`
+                                exception is raised.
+    :param max_form_parts: the maximum number of fields and files.  If
+                           there are more an
+                           :exc:`~exceptions.RequestEntityTooLarge`
+                           exception is raised before the rest of the data
+                           is parsed.
     :return: A tuple in the form ``(stream, form, files)``.
     """
     content_type, extra = parse_options_header(environ.get('CONTENT_TYPE', ''))
@@ -102,7 +248,10 @@ def parse_form_data(environ, stream_factory=None, charset='utf-8',
                                           extra.get('boundary'),
                                           content_length, stream_factory,
                                           charset, errors,
-                                          max_form_memory_size=max_form_memory_size)
+                                          max_form_memory_size=max_form_memory_size,
+                                          file_handlers=file_handlers,
+                                          max_form_field_size=max_form_field_size,
+                                          max_form_parts=max_form_parts)
         except ValueError, e:
             if not silent:
                 raise
@@ -114,8 +263,10 @@ def parse_form_data(environ, stream_factory=None, charset='utf-8',
         if max_form_memory_size is not None and \
            content_length > max_form_memory_size:
             raise RequestEntityTooLarge()
-        form = url_decode(environ['wsgi.input'].read(content_length),
-                          charset, errors=errors, cls=cls)
+        form = url_decode_stream(environ['wsgi.input'], charset,
+                                 errors=errors, cls=cls,
+                                 limit=content_length,
+                                 max_pairs=max_form_parts)
     else:
         form = cls()
         stream = LimitedStream(environ['wsgi.input'], content_length)
@@ -144,18 +295,70 @@ def _line_parse(line):
     return line, False
 
 
-def _find_terminator(iterator):
-    """The terminator might have some additional newlines before it.
-    There is at least one application that sends additional newlines
-    before headers (the python setuptools package).
+def _find_line_end(buffer, pos):
+    """Returns the line ending (``'\\r\\n'``, ``'\\n'`` or ``'\\r'``) that
+    follows optional transport padding at `pos`.  If the buffer ends before
+    the line ending could be determined `None` is returned, if there is
+    something else than padding at that position an empty string.
     """
-    for line in iterator:
-        if not line:
-            break
-        line = line.strip()
-        if line:
-            return line
-    return ''
+    end = len(buffer)
+    while pos < end and buffer[pos] in ' \t':
+        pos += 1
+    if pos >= end:
+        return None
+    char = buffer[pos]
+    if char == '\n':
+        return '\n'
+    elif char != '\r':
+        return ''
+    elif pos + 1 >= end:
+        return None
+    elif buffer[pos + 1] == '\n':
+        return '\r\n'
+    return '\r'
+
+
+def _make_transfer_decoder(write, transfer_encoding):
+    """Returns a tuple in the form ``(write, flush)`` that decodes the
+    transfer encoded data in blocks before it is passed to `write`.  The
+    data is decoded up to the last newline, base64 data that is not
+    wrapped into lines of a multiple of four characters is stripped and
+    decoded in blocks of a multiple of four characters instead.  The rest
+    is carried over to the next write.
+    """
+    pending = []
+    def _decode(data):
+        try:
+            if transfer_encoding == 'base64':
+                return a2b_base64(data)
+            return a2b_qp(data)
+        except:
+            raise ValueError('could not decode transfer encoded chunk')
+    def decoding_write(data):
+        pending.append(data)
+        data = ''.join(pending)
+        cutoff = data.rfind('\n') + 1
+        decoded = None
+        if cutoff:
+            try:
+                decoded = _decode(data[:cutoff])
+            except ValueError:
+                if transfer_encoding != 'base64':
+                    raise
+        if decoded is None and transfer_encoding == 'base64':
+            data = data.translate(_identity_table, ' \t\r\n')
+            cutoff = len(data) & ~3
+            if cutoff:
+                decoded = _decode(data[:cutoff])
+        pending[:] = [data[cutoff:]]
+        if decoded:
+            write(decoded)
+    def flush():
+        data = ''.join(pending)
+        if data:
+            write(_decode(data))
+        del pending[:]
+    return decoding_write, flush
 
 
 def is_valid_multipart_boundary(boundary):
@@ -163,156 +366,301 @@ def is_valid_multipart_boundary(boundary):
     return _multipart_boundary_re.match(boundary) is not None
 
 
+class MultiPartParser(object):
+    """An incremental parser for multipart data.  Unlike
+    :func:`parse_form_data` it does not read from a stream but is fed with
+    the data as it arrives which makes it possible to parse uploads in an
+    event loop without blocking::
+
+        parser = MultiPartParser(boundary)
+        for event, value in parser.feed(chunk):
+            if event == 'headers':
+                # a new part starts, value is a `Headers` object
+                ...
+            elif event == 'data':
+                # value is a string with data of the current part
+                ...
+            elif event == 'end':
+                # the current part ended, value is `None`
+                ...
+
+    Every call to :meth:`feed` returns the list of events the data
+    completed.  The data of a part is passed on as soon as the parser knows
+    that it does not belong to a boundary and is not decoded, even if the
+    part has a `Content-Transfer-Encoding` header.  After the last part
+    :attr:`finished` is `True` and further data is ignored.  If the data
+    is malformed a :exc:`ValueError` is raised.
+
+    .. versionadded:: 0.6
+
+    :param boundary: the boundary from the content type header.
+    :param max_header_size: the maximum size of the header block of a
+                            part in bytes.
+    """
+
+    def __init__(self, boundary, max_header_size=10 * 1024):
+        if not boundary:
+            raise ValueError('Missing boundary')
+        if not is_valid_multipart_boundary(boundary):
+            raise ValueError('Invalid boundary: %s' % boundary)
+        self.boundary = boundary
+        self.max_header_size = max_header_size
+        #: `True` if the last part was parsed.
+        self.finished = False
+        self._next_part = '--' + boundary
+        self._newline = self._delimiter = None
+        self._buffer = ''
+        self._state = self._parse_preamble
+
+    def feed(self, data):
+        """Feeds the parser with the next chunk of data and returns the list
+        of events in the form ``(event, value)``.
+        """
+        events = []
+        if self.finished or not data:
+            return events
+        self._buffer += data
+        pos = 0
+        while 1:
+            new_pos = self._state(pos, events)
+            if new_pos is None:
+                break
+            pos = new_pos
+        self._buffer = self._buffer[pos:]
+        return events
+
+    def close(self):
+        """Tells the parser that there is no more data.  If the parser did
+        not see the last part yet a :exc:`ValueError` is raised.
+        """
+        if self.finished:
+            return
+        if self._state == self._parse_preamble:
+            raise ValueError('Expected boundary at start of multipart data')
+        elif self._state == self._parse_headers:
+            raise ValueError('unexpected end of multipart headers')
+        raise ValueError('unexpected end of part')
+
+    def _parse_preamble(self, pos, events):
+        # the terminator might have some additional newlines before it.
+        # There is at least one application that sends additional newlines
+        # before headers (the python setuptools package).
+        buffer = self._buffer
+        end = len(buffer)
+        while pos < end and buffer[pos] in ' \t\r\n':
+            pos += 1
+        next_part = self._next_part
+        after = pos + len(next_part)
+        if buffer[pos:after] != next_part[:end - pos]:
+            raise ValueError('Expected boundary at start of multipart data')
+        tail = buffer[after:after + 2]
+        if tail == '--':
+            self.finished = True
+            self._state = self._parse_epilogue
+            return after + 2
+        newline = tail != '-' and _find_line_end(buffer, after)
+        if newline is None or newline is False:
+            return None
+        if not newline:
+            raise ValueError('Expected boundary at start of multipart data')
+        self._newline = newline
+        self._delimiter = newline + next_part
+        self._state = self._parse_headers
+        return buffer.index(newline, after) + len(newline)
+
+    def _parse_headers(self, pos, events):
+        # the header block is terminated by an empty line.  If there are
+        # no headers at all the empty line follows the boundary directly.
+        buffer = self._buffer
+        newline = self._newline
+        if buffer.startswith(newline, pos):
+            header_block = ''
+            pos += len(newline)
+        elif newline.startswith(buffer[pos:]):
+            return None
+        else:
+            end = buffer.find(newline * 2, pos)
+            if end < 0:
+                if len(buffer) - pos > self.max_header_size:
+                    raise ValueError('multipart headers too long')
+                return None
+            header_block = buffer[pos:end + len(newline)]
+            pos = end + len(newline) * 2
+        events.append(('headers',
+                       parse_multipart_headers(header_block.splitlines(True))))
+        self._state = self._parse_data
+        return pos
+
+    def _parse_data(self, pos, events):
+        # search the buffer for the next delimiter and pass everything in
+        # front of it on.  If there is no delimiter in the buffer we keep
+        # as many bytes as the delimiter is long in case it was cut in half.
+        buffer = self._buffer
+        delimiter = self._delimiter
+        end = buffer.find(delimiter, pos)
+        while end >= 0:
+            after = end + len(delimiter)
+            tail = buffer[after:after + 2]
+            if tail == '--':
+                terminator = '--'
+                break
+            elif tail == '-':
+                terminator = None
+                break
+            terminator = _find_line_end(buffer, after)
+            if terminator is None or terminator == self._newline:
+                break
+            end = buffer.find(delimiter, end + 1)
+        if end < 0:
+            end = max(pos, len(buffer) - len(delimiter))
+            terminator = None
+        if end > pos:
+            events.append(('data', buffer[pos:end]))
+        if not terminator:
+            return end > pos and end or None
+        events.append(('end', None))
+        if terminator == '--':
+            self.finished = True
+            self._state = self._parse_epilogue
+            return after + 2
+        self._state = self._parse_headers
+        return buffer.index(terminator, after) + len(terminator)
+
+    def _parse_epilogue(self, pos, events):
+        return None
+
+
 def parse_multipart(file, boundary, content_length, stream_factory=None,
-                    charset='utf-8', errors='ignore', buffer_size=10 * 1024,
-                    max_form_memory_size=None):
+                    charset='utf-8', errors='ignore', buffer_size=64 * 1024,
+                    max_form_memory_size=None, file_handlers=None,
+                    max_form_field_size=None, max_form_parts=None):
     """Parse a multipart/form-data stream.  This is invoked by
     :func:`utils.parse_form_data` if the content type matches.  Currently it
     exists for internal usage only, but could be exposed as separate
     function if it turns out to be useful and if we consider the API stable.
+
+    The stream is read in blocks of `buffer_size` bytes which are fed to a
+    :class:`MultiPartParser`.  Files in fields listed in `file_handlers`
+    are written to the object returned by the handler instead of a stream
+    from the `stream_factory`.  The form fields are kept as bytes until
+    all the data is parsed and decoded afterwards so that no work is
+    wasted on requests that exceed one of the limits.
     """
     # XXX: this function does not support multipart/mixed.  I don't know of
     #      any browser that supports this, but it should be implemented
     #      nonetheless.
 
-    # make sure the buffer size is divisible by four so that we can base64
-    # decode chunk by chunk
-    assert buffer_size % 4 == 0, 'buffer size has to be divisible by 4'
-    # also the buffer size has to be at least 1024 bytes long or long headers
+    # the buffer size has to be at least 1024 bytes long or long headers
     # will freak out the system
     assert buffer_size >= 1024, 'buffer size has to be at least 1KB'
 
     if stream_factory is None:
         stream_factory = default_stream_factory
-
-    if not boundary:
-        raise ValueError('Missing boundary')
-    if not is_valid_multipart_boundary(boundary):
-        raise ValueError('Invalid boundary: %s' % boundary)
-    if len(boundary) > buffer_size:
+    if boundary and len(boundary) > buffer_size:
         raise ValueError('Boundary longer than buffer size')
 
+    parser = MultiPartParser(boundary, buffer_size)
     total_content_length = content_length
-    next_part = '--' + boundary
-    last_part = next_part + '--'
 
     form = []
     files = []
     in_memory = 0
+    parts = 0
+    guard_memory = max_form_memory_size is not None or \
+                   max_form_field_size is not None
 
-    # convert the file into a limited stream with iteration capabilities
     file = LimitedStream(file, content_length)
-    iterator = chain(make_line_iter(file, buffer_size=buffer_size),
-                     _empty_string_iter)
+    _read = file.read
 
     try:
-        terminator = _find_terminator(iterator)
-        if terminator != next_part:
-            raise ValueError('Expected boundary at start of multipart data')
+        while not parser.finished:
+            chunk = _read(buffer_size)
+            if not chunk:
+                parser.close()
+            for event, value in parser.feed(chunk):
+                if event == 'data':
+                    _write(value)
+                    # if we write into memory and there is a memory size
+                    # limit we count the number of bytes in memory and raise
+                    # exceptions if there is too much data in memory.
+                    if guard_memory and not is_file:
+                        in_memory += len(value)
+                        field_size += len(value)
+                        if (max_form_memory_size is not None and
+                            in_memory > max_form_memory_size) or \
+                           (max_form_field_size is not None and
+                            field_size > max_form_field_size):
+                            raise RequestEntityTooLarge()
+
+                elif event == 'headers':
+                    parts += 1
+                    if max_form_parts is not None and parts > max_form_parts:
+                        raise RequestEntityTooLarge()
+                    headers = value
+                    disposition = headers.get('content-disposition')
+                    if disposition is None:
+                        raise ValueError('Missing Content-Disposition header')
+                    disposition, extra = parse_options_header(disposition)
+                    name = extra.get('name')
+                    filename = extra.get('filename')
+
+                    # if no content type is given we stream into memory.  As
+                    # temporary container a list is used.
+                    if filename is None:
+                        is_file = False
+                        container = []
+                        _write = container.append
+                        field_size = 0
+
+                    # otherwise we parse the rest of the headers and ask the
+                    # stream factory for something we can write in.
+                    else:
+                        content_type = headers.get('content-type')
+                        content_type = parse_options_header(content_type)[0] \
+                            or 'text/plain'
+                        is_file = True
+                        filename = _fix_ie_filename(_decode_unicode(filename,
+                                                                    charset,
+                                                                    errors))
+                        try:
+                            content_length = int(headers['content-length'])
+                        except (KeyError, ValueError):
+                            content_length = 0
+                        handler = file_handlers and file_handlers.get(name)
+                        if handler is not None:
+                            container = handler(filename, content_type,
+                                                content_length, headers)
+                        else:
+                            container = stream_factory(total_content_length,
+                                                       content_type, filename,
+                                                       content_length)
+                        _write = container.write
+
+                    transfer_encoding = headers.get('content-transfer-encoding')
+                    flush = None
+                    if transfer_encoding is not None and \
+                       transfer_encoding in _supported_multipart_encodings:
+                        _write, flush = _make_transfer_decoder(_write,
+                                                               transfer_encoding)
 
-        while terminator != last_part:
-            headers = parse_multipart_headers(iterator)
-            disposition = headers.get('content-disposition')
-            if disposition is None:
-                raise ValueError('Missing Content-Disposition header')
-            disposition, extra = parse_options_header(disposition)
-            name = extra.get('name')
-
-            transfer_encoding = headers.get('content-transfer-encoding')
-            try_decode = transfer_encoding is not None and \
-                         transfer_encoding in _supported_multipart_encodings
-
-            filename = extra.get('filename')
-
-            # if no content type is given we stream into memory.  As temporary
-            # container a list is used.
-            if filename is None:
-                is_file = False
-                container = []
-                _write = container.append
-                guard_memory = max_form_memory_size is not None
-
-            # otherwise we parse the rest of the headers and ask the stream
-            # factory for something we can write in.
-            else:
-                content_type = headers.get('content-type')
-                content_type = parse_options_header(content_type)[0] \
-                    or 'text/plain'
-                is_file = True
-                guard_memory = False
-                if filename is not None:
-                    filename = _fix_ie_filename(_decode_unicode(filename,
-                                                                charset,
-                                                                errors))
-                try:
-                    content_length = int(headers['content-length'])
-                except (KeyError, ValueError):
-                    content_length = 0
-                container = stream_factory(total_content_length, content_type,
-                                           filename, content_length)
-                _write = container.write
-
-            buf = ''
-            for line in iterator:
-                if not line:
-                    raise ValueError('unexpected end of stream')
-
-                if line[:2] == '--':
-                    terminator = line.rstrip()
-                    if terminator in (next_part, last_part):
-                        break
-
-                if try_decode:
-                    try:
-                        line = line.decode(transfer_encoding)
-                    except:
-                        raise ValueError('could not decode transfer '
-                                         'encoded chunk')
-
-                # we have something in the buffer from the last iteration.
-                # this is usually a newline delimiter.
-                if buf:
-                    _write(buf)
-                    buf = ''
-
-                # If the line ends with windows CRLF we write everything except
-                # the last two bytes.  In all other cases however we write
-                # everything except the last byte.  If it was a newline, that's
-                # fine, otherwise it does not matter because we will write it
-                # the next iteration.  this ensures we do not not write the
-                # final newline into the stream.  That way we do not have to
-                # truncate the stream.
-                if line[-2:] == '\r\n':
-                    buf = '\r\n'
-                    cutoff = -2
                 else:
-                    buf = line[-1]
-                    cutoff = -1
-                _write(line[:cutoff])
-
-                # if we write into memory and there is a memory size limit we
-                # count the number of bytes in memory and raise exceptiosn if
-                # there is too much data in memory.
-                if guard_memory:
-                    in_memory += len(line)
-                    if in_memory > max_form_memory_size:
-                        from werkzeug.exceptions import RequestEntityTooLarge
-                        raise RequestEntityTooLarge()
-            else:
-                raise ValueError('unexpected end of part')
-
-            if is_file:
-                container.seek(0)
-                files.append((name, FileStorage(container, filename, name,
-                                                content_type,
-                                                content_length, headers)))
-            else:
-                form.append((name, _decode_unicode(''.join(container),
-                                                   charset, errors)))
+                    if flush is not None:
+                        flush()
+                    if is_file:
+                        if hasattr(container, 'seek'):
+                            container.seek(0)
+                        files.append((name, FileStorage(container, filename,
+                                                        name, content_type,
+                                                        content_length,
+                                                        headers)))
+                    else:
+                        form.append((name, ''.join(container)))
     finally:
         # make sure the whole input stream is read
         file.exhaust()
 
+    form = [(name, _decode_unicode(value, charset, errors))
+            for name, value in form]
     return form, files
 
 
@@ -341,8 +689,8 @@ def parse_multipart_headers(iterable):
 
 
 # circurlar dependencies
-from werkzeug.urls import url_decode
-from werkzeug.wsgi import LimitedStream, make_line_iter
+from werkzeug.urls import url_decode_stream
+from werkzeug.wsgi import LimitedStream
 from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.datastructures import Headers, FileStorage, MultiDict
 from werkzeug.http import parse_options_header
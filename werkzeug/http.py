@@ -34,6 +34,10 @@ except ImportError:
 #: XXX: move to werkzeug.consts or something
 from werkzeug._internal import HTTP_STATUS_CODES
 
+#: the default for the maximum number of ranges :func:`get_requested_ranges`
+#: accepts before it asks for the whole resource to be sent.
+MAX_RANGES = 16
+
 
 _accept_re = re.compile(r'([^\s;,]+)(?:[^,]*?;\s*q=(\d*(?:\.\d+)?))?')
 _token_chars = frozenset("!#$%&'*+-.0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -472,6 +476,110 @@ def parse_date(value):
             return datetime.utcfromtimestamp(mktime_tz(t))
 
 
+def parse_range_header(value):
+    """Parses a range header into a :class:`Range` object.  If the header
+    is missing or malformed `None` is returned.
+
+    .. versionadded:: 0.6
+
+    :param value: the range header to parse.
+    :return: a :class:`Range` object or `None`.
+    """
+    if not value or '=' not in value:
+        return None
+    units, rng = value.split('=', 1)
+    units = units.strip().lower()
+    ranges = []
+    for item in rng.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' not in item:
+            return None
+        begin, end = item.split('-', 1)
+        begin = begin.strip()
+        end = end.strip()
+        if not begin:
+            if not end.isdigit():
+                return None
+            end = int(end)
+            ranges.append(end and (-end, None) or (0, 0))
+            continue
+        if not begin.isdigit() or (end and not end.isdigit()):
+            return None
+        begin = int(begin)
+        if not end:
+            ranges.append((begin, None))
+            continue
+        end = int(end) + 1
+        if begin >= end:
+            return None
+        ranges.append((begin, end))
+    if not ranges:
+        return None
+    return Range(units, ranges)
+
+
+def parse_if_range_header(value):
+    """Parses an if-range header which can be an etag or a date.  Returns
+    a :class:`IfRange` object.
+
+    .. versionadded:: 0.6
+
+    :param value: the if-range header to parse.
+    :return: a :class:`IfRange` object.
+    """
+    if not value:
+        return IfRange()
+    date = parse_date(value)
+    if date is not None:
+        return IfRange(date=date)
+    etag, weak = unquote_etag(value)
+    return IfRange(etag, weak=weak)
+
+
+def get_requested_ranges(environ, length, etag=None, last_modified=None,
+                         max_ranges=MAX_RANGES):
+    """Returns the byte ranges the request asks for as list of
+    ``(start, stop)`` tuples for a resource of the given length.  If the
+    whole resource should be sent because the request method is not `GET`,
+    there is no valid `Range` header, the `If-Range` header does not
+    match the resource or the request asks for more than `max_ranges`
+    ranges after merging overlapping ones `None` is returned.  If no range
+    is satisfiable the return value is an empty list and the response
+    should be ``416 Requested Range Not Satisfiable``.
+
+    .. versionadded:: 0.6
+
+    :param environ: the WSGI environment of the request to be checked.
+    :param length: the length of the resource in bytes.
+    :param etag: the etag of the resource for the `If-Range` check.
+    :param last_modified: an optional date of the last modification.
+    :param max_ranges: the maximum number of ranges sent in one response.
+    :return: a list of ``(start, stop)`` tuples or `None`.
+    """
+    if environ['REQUEST_METHOD'] != 'GET':
+        return None
+    rng = parse_range_header(environ.get('HTTP_RANGE'))
+    if rng is None or rng.units != 'bytes':
+        return None
+    if_range = parse_if_range_header(environ.get('HTTP_IF_RANGE'))
+    if if_range.date is not None:
+        if isinstance(last_modified, basestring):
+            last_modified = parse_date(last_modified)
+        if last_modified is None or \
+           last_modified.replace(microsecond=0) != if_range.date:
+            return None
+    elif if_range.etag is not None:
+        if if_range.weak or etag is None or \
+           unquote_etag(etag) != (if_range.etag, False):
+            return None
+    ranges = rng.ranges_for_length(length)
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
 def is_resource_modified(environ, etag=None, data=None, last_modified=None):
     """Convenience method for conditional requests.
 
@@ -559,7 +667,7 @@ def is_hop_by_hop_header(header):
 # circular dependency fun
 from werkzeug.datastructures import Headers, Accept, RequestCacheControl, \
      ResponseCacheControl, HeaderSet, ETags, Authorization, \
-     WWWAuthenticate
+     WWWAuthenticate, Range, IfRange
 
 
 # DEPRECATED
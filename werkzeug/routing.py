@@ -96,9 +96,14 @@
                              Thomas Johansson.
     :license: BSD, see LICENSE for more details.
 """
+import os
 import re
+import sys
+import cPickle as pickle
+from time import time
+from bisect import bisect_right
 from urlparse import urljoin
-from itertools import izip
+from itertools import izip, imap, count
 
 from werkzeug.urls import url_encode, url_quote
 from werkzeug.utils import redirect, format_string
@@ -118,6 +123,11 @@ _rule_re = re.compile(r'''
 ''', re.VERBOSE)
 _simple_rule_re = re.compile(r'<([^>]+)>')
 
+#: the version of the file format used by :meth:`Map.save`.  Files with a
+#: different version are not loaded.
+_map_file_version = 3
+_named_group_re = re.compile(r'\\.|\(\?P<[a-zA-Z_][a-zA-Z0-9_]*>')
+
 
 def parse_rule(rule):
     """Parse a rule and return it as generator. Each iteration yields tuples
@@ -151,6 +161,75 @@ def parse_rule(rule):
         yield None, None, remaining
 
 
+def _strip_group_name(match):
+    """Turn a named group into a non capturing group, keeps escapes."""
+    value = match.group()
+    if value[0] == '\\':
+        return value
+    return '(?:'
+
+
+def _join_script_path(script_name, path):
+    """Join the script name of an adapter and a path built by a rule like
+    ``urljoin(script_name, path.lstrip('/'))`` does.  Only paths that
+    `urljoin` would treat special go through `urljoin`, others are just
+    concatenated.
+
+    :internal:
+    """
+    path = path.lstrip('/')
+    if ':' in path or ';' in path or '#' in path or path[-1:] == '?' or \
+       path[:1] == '.' or '/.' in path or '/.' in script_name:
+        return urljoin(script_name, path)
+    return script_name + path
+
+
+class _LazyRegex(object):
+    """A regular expression that is compiled the first time it's used.  The
+    rules and matchers of pickled maps use this so that loading a map does
+    not have to compile all regular expressions at once.
+
+    :internal:
+    """
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, name):
+        regex = self.__dict__.get('_regex')
+        if regex is None:
+            regex = self._regex = re.compile(self.pattern, self.flags)
+            self.search = regex.search
+            self.match = regex.match
+        return getattr(regex, name)
+
+    def __reduce__(self):
+        return _LazyRegex, (self.pattern, self.flags)
+
+
+def _make_lazy(regex):
+    """Wrap a compiled regular expression for pickling."""
+    if regex is None:
+        return None
+    return _LazyRegex(regex.pattern, regex.flags)
+
+
+def _drop_none_values(values):
+    """Return the values for URL building without the values that are
+    `None`.  If there are no such values the dict is returned unchanged.
+
+    :internal:
+    """
+    if not values:
+        return {}
+    for value in values.itervalues():
+        if value is None:
+            return dict([(k, v) for k, v in values.iteritems()
+                         if v is not None])
+    return values
+
+
 def get_converter(map, name, args):
     """Create a new converter for the given arguments or raise
     exception if the converter does not exist.
@@ -494,6 +573,10 @@ class Rule(RuleFactory):
         self._converters = {}
         self._regex = None
         self._weights = []
+        self._builder = None
+        self._converter = None
+        self._required_arguments = ()
+        self._default_providers = ()
 
     def empty(self):
         """Return an unbound copy of this rule.  This can be useful if you
@@ -552,6 +635,82 @@ class Rule(RuleFactory):
             )
             self._regex = re.compile(regex, re.UNICODE)
 
+        defaults = self.defaults or ()
+        self._required_arguments = tuple([x for x in self.arguments
+                                          if x not in defaults])
+
+    def _compile_builder(self):
+        """Generate a function that assembles the subdomain and the path
+        for :meth:`build` from the values without walking the trace.  This
+        happens the first time the rule is used for URL building.
+
+        :internal:
+        """
+        namespace = {'ValidationError': ValidationError}
+        subdomain_parts = []
+        path_parts = []
+        parts = subdomain_parts
+        for is_dynamic, data in self._trace:
+            if is_dynamic:
+                name = 'c%d' % len(namespace)
+                namespace[name] = self._converters[data].to_url
+                parts.append('%s(values[%r])' % (name, data))
+                continue
+            if parts is subdomain_parts and '|' in data:
+                subdomain, data = data.split('|', 1)
+                if subdomain:
+                    namespace['s%d' % len(namespace)] = subdomain
+                    subdomain_parts.append('s%d' % (len(namespace) - 1))
+                parts = path_parts
+            if data:
+                name = 's%d' % len(namespace)
+                namespace[name] = data
+                parts.append(name)
+
+        code = compile('''def build(values):
+    try:
+        return u''.join((%s,)), u''.join((%s,))
+    except ValidationError:
+        pass
+''' % (', '.join(subdomain_parts) or "u''", ', '.join(path_parts) or "u''"),
+            '<builder for %r>' % self.rule, 'exec')
+        exec code in namespace
+        return namespace['build']
+
+    def _compile_converter(self):
+        """Generate a function that converts the values of the regular
+        expression groups and returns them as dict or `None` if a converter
+        rejected a value.  Converters with a simple conversion are called
+        directly or not at all instead of calling their `to_python` method.
+        This happens the first time the rule matches.
+
+        :internal:
+        """
+        namespace = {'ValidationError': ValidationError}
+        items = []
+        for name, converter in self._converters.iteritems():
+            conversion = converter.get_simple_conversion()
+            if conversion is None:
+                conversion = converter.to_python
+                cache_size = converter.python_cache_size
+                if cache_size:
+                    conversion = _cached_conversion(conversion, cache_size)
+            value = 'groups[%r]' % str(name)
+            if conversion is not unicode:
+                func = 'c%d' % len(namespace)
+                namespace[func] = conversion
+                value = '%s(%s)' % (func, value)
+            items.append('%r: %s' % (str(name), value))
+
+        code = compile('''def convert(groups):
+    try:
+        return {%s}
+    except ValidationError:
+        pass
+''' % ', '.join(items), '<converter for %r>' % self.rule, 'exec')
+        exec code in namespace
+        return namespace['convert']
+
     def match(self, path):
         """Check if the rule matches a given path. Path is a string in the
         form ``"subdomain|/path(method)"`` and is assembled by the map.
@@ -577,13 +736,12 @@ class Rule(RuleFactory):
                 elif not self.strict_slashes:
                     del groups['__suffix__']
 
-                result = {}
-                for name, value in groups.iteritems():
-                    try:
-                        value = self._converters[name].to_python(value)
-                    except ValidationError:
-                        return
-                    result[str(name)] = value
+                convert = self._converter
+                if convert is None:
+                    convert = self._converter = self._compile_converter()
+                result = convert(groups)
+                if result is None:
+                    return
                 if self.defaults is not None:
                     result.update(self.defaults)
                 return result
@@ -594,28 +752,27 @@ class Rule(RuleFactory):
 
         :internal:
         """
-        tmp = []
-        add = tmp.append
-        processed = set(self.arguments)
-        for is_dynamic, data in self._trace:
-            if is_dynamic:
-                try:
-                    add(self._converters[data].to_url(values[data]))
-                except ValidationError:
-                    return
-                processed.add(data)
-            else:
-                add(data)
-        subdomain, url = (u''.join(tmp)).split('|', 1)
+        builder = self._builder
+        if builder is None:
+            builder = self._builder = self._compile_builder()
+        rv = builder(values)
+        if rv is None:
+            return
+        arguments = self.arguments
+        for key in values:
+            if key not in arguments:
+                break
+        else:
+            return rv
 
+        subdomain, url = rv
         query_vars = {}
-        for key in set(values) - processed:
-            query_vars[key] = unicode(values[key])
-        if query_vars:
-            url += '?' + url_encode(query_vars, self.map.charset,
-                                    sort=self.map.sort_parameters,
-                                    key=self.map.sort_key)
-
+        for key, value in values.iteritems():
+            if key not in arguments:
+                query_vars[key] = unicode(value)
+        url += '?' + url_encode(query_vars, self.map.charset,
+                                sort=self.map.sort_parameters,
+                                key=self.map.sort_key)
         return subdomain, url
 
     def provides_defaults_for(self, rule):
@@ -635,21 +792,45 @@ class Rule(RuleFactory):
         if self.methods is not None and method not in self.methods:
             return False
 
-        valueset = set(values)
-
-        for key in self.arguments - set(self.defaults or ()):
+        for key in self._required_arguments:
             if key not in values:
                 return False
 
-        if self.arguments.issubset(valueset):
-            if self.defaults is None:
-                return True
+        if self.defaults:
+            for key in self.defaults:
+                if key not in values:
+                    return True
             for key, value in self.defaults.iteritems():
                 if value != values[key]:
                     return False
 
         return True
 
+    def get_match_key(self):
+        """Return a key that sorts the rules in the same order as
+        :meth:`match_compare` does.  Each weight is wrapped in a tuple and
+        the weights are terminated with ``(1,)`` so that a rule with more
+        weights comes first if all the other weights are equal.
+
+        :internal:
+        """
+        return tuple([(0, -w) for w in self._weights]) + ((1,),), \
+            bool(self.arguments), self.defaults is not None, \
+            -self.greediness, len(self.arguments)
+
+    def get_build_key(self):
+        """Return a key that sorts the rules of an endpoint in the same
+        order as :meth:`build_compare` does.  Rules with defaults come
+        before the rules without because only they can provide defaults
+        for other rules.  That a rule providing defaults for a build only
+        rule comes first is not part of the key but handled by
+        :meth:`Map.add`.
+
+        :internal:
+        """
+        return not self.arguments, self.defaults is None, \
+            not self.defaults, -self.greediness, -len(self.arguments)
+
     def match_compare(self, other):
         """Compare this object with another one for matching.
 
@@ -709,6 +890,16 @@ class Rule(RuleFactory):
             return 1
         return -1
 
+    def __getstate__(self):
+        # the generated builder and converter cannot be pickled and are
+        # recreated on demand.  the regular expression is compiled on first
+        # use.
+        state = self.__dict__.copy()
+        state['_builder'] = None
+        state['_converter'] = None
+        state['_regex'] = _make_lazy(self._regex)
+        return state
+
     def __eq__(self, other):
         return self.__class__ is other.__class__ and \
                self._trace == other._trace
@@ -748,9 +939,32 @@ class BaseConverter(object):
     is_greedy = False
     weight = 100
 
+    #: if set to a number the results of :meth:`to_python` are remembered
+    #: for that many matched values.  Useful for expensive conversions
+    #: like looking up objects by a slug.  The results are never
+    #: invalidated so the conversion must always return the same value
+    #: for the same URL part.
+    python_cache_size = None
+
     def __init__(self, map):
         self.map = map
 
+    def get_simple_conversion(self):
+        """Return a function that converts a matched value like
+        :meth:`to_python` but without validating it, or `None` if
+        :meth:`to_python` has to be called.  Rules call this function
+        directly which is faster.  It must not fail for values that match
+        the regular expression of the converter.  If it's `unicode` the
+        value is used as it is.
+
+        The default implementation returns `unicode` if :meth:`to_python`
+        was not overridden.
+
+        .. versionadded:: 0.6
+        """
+        if type(self).to_python.im_func is BaseConverter.to_python.im_func:
+            return unicode
+
     def to_python(self, value):
         return value
 
@@ -834,6 +1048,12 @@ class NumberConverter(BaseConverter):
         self.min = min
         self.max = max
 
+    def get_simple_conversion(self):
+        if not self.fixed_digits and self.min is None and \
+           self.max is None and type(self).to_python.im_func is \
+           NumberConverter.to_python.im_func:
+            return self.num_convert
+
     def to_python(self, value):
         if (self.fixed_digits and len(value) != self.fixed_digits):
             raise ValidationError()
@@ -887,6 +1107,398 @@ class FloatConverter(NumberConverter):
         NumberConverter.__init__(self, map, 0, min, max)
 
 
+class RuleMatcher(object):
+    """Base class for the matching engines of a :class:`Map`.  A matcher is
+    created by :meth:`Map.update` with the rules of the map in the order
+    defined by :meth:`Rule.match_compare` and has to find the rules that
+    match a path in exactly that order.
+
+    Matchers are selected by passing the name of a matcher from
+    :data:`DEFAULT_MATCHERS` or a subclass of this class as `matcher` to
+    the map.  Subclasses have to override :meth:`match`.
+
+    .. versionadded:: 0.6
+
+    :param map: the :class:`Map` the matcher is created for.
+    :param rules: the sorted rules of the map.
+    """
+
+    def __init__(self, map, rules):
+        self.map = map
+        self.rules = rules
+        self._positions = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_positions'] = None
+        return state
+
+    def get_position(self, rule):
+        """Return the number of rules in front of the given rule.  That's
+        the number of rules a linear search has to test before it reaches
+        the rule.
+        """
+        if self._positions is None:
+            self._positions = dict((id(rule), idx) for idx, rule
+                                   in enumerate(self.rules))
+        return self._positions[id(rule)]
+
+    def match(self, subdomain, path):
+        """Iterate over all rules that match the given subdomain and path
+        in matching order.  Each iteration yields a ``(rule, values)`` tuple
+        where the values are the converted values of the rule.
+
+        If a branch rule matches without the trailing slash the
+        :exc:`RequestSlash` exception of :meth:`Rule.match` is passed through
+        to the caller.
+
+        :param subdomain: the current subdomain.
+        :param path: the path info with exactly one leading slash.
+        """
+        raise NotImplementedError()
+
+
+class LinearMatcher(RuleMatcher):
+    """The default matcher.  It tests the regular expression of every rule
+    until one matches.  This is fast enough for small and medium sized maps
+    and has no setup costs.
+    """
+
+    def match(self, subdomain, path):
+        path = u'%s|%s' % (subdomain, path)
+        for rule in self.rules:
+            rv = rule.match(path)
+            if rv is not None:
+                yield rule, rv
+
+
+class _TrieNode(object):
+    """A node of the prefix tree used by the :class:`TrieMatcher`."""
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+
+
+class TrieMatcher(RuleMatcher):
+    """A matcher that indexes the rules by the static path segments in front
+    of the first variable part in a prefix tree.  To match a path the tree is
+    walked segment by segment and only the rules attached to the visited
+    nodes are tested.  Because of that the matching costs grow with the depth
+    of the path instead of the number of rules in the map which is a big
+    improvement for maps with hundreds of rules.
+
+    Rules with a dynamic subdomain are stored in a separate tree that is
+    walked for every subdomain.
+    """
+
+    def __init__(self, map, rules):
+        RuleMatcher.__init__(self, map, rules)
+        self._roots = {}
+        for idx, rule in enumerate(rules):
+            if rule.build_only:
+                continue
+            if '<' in rule.subdomain:
+                key = None
+            else:
+                key = rule.subdomain
+            node = self._roots.get(key)
+            if node is None:
+                node = self._roots[key] = _TrieNode()
+            for segment in self.get_static_segments(rule):
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _TrieNode()
+                node = child
+            node.rules.append((idx, rule))
+
+    def get_static_segments(rule):
+        """Return the complete static path segments in front of the first
+        variable part of a rule.  Partial segments that are followed by a
+        variable part in the same segment are not part of the result.
+        """
+        path = rule.is_leaf and rule.rule or rule.rule.rstrip('/')
+        idx = path.find('<')
+        if idx < 0:
+            return path.split('/')[1:]
+        return path[:idx].split('/')[1:-1]
+    get_static_segments = staticmethod(get_static_segments)
+
+    def match(self, subdomain, path):
+        candidates = []
+        segments = path.split('/')[1:]
+        for key in subdomain, None:
+            node = self._roots.get(key)
+            for segment in segments:
+                if node is None:
+                    break
+                candidates.extend(node.rules)
+                node = node.children.get(segment)
+            else:
+                if node is not None:
+                    candidates.extend(node.rules)
+        candidates.sort()
+        path = u'%s|%s' % (subdomain, path)
+        for idx, rule in candidates:
+            rv = rule.match(path)
+            if rv is not None:
+                yield rule, rv
+
+
+class RegexMatcher(RuleMatcher):
+    """A matcher that combines the regular expressions of all rules into
+    an alternation so that a single call into the regular expression engine
+    finds the first matching rule.  The rule is then looked up by the index
+    of the group that matched.
+
+    If the converters of a matched rule reject the value or the caller asks
+    for more matches the rules after the matched one are tested one after
+    another until the end of the current alternation is reached.
+
+    Because the number of groups in a regular expression is limited the
+    rules are split into multiple alternations if necessary.
+    """
+
+    #: the maximum number of groups in one combined regular expression.
+    max_groups = 99
+
+    def __init__(self, map, rules):
+        RuleMatcher.__init__(self, map, rules)
+        self._alternations = []
+        parts = []
+        group_rules = [None]
+        for rule in rules:
+            if rule.build_only:
+                continue
+            regex = rule._regex
+            groups = regex.groups - len(regex.groupindex) + 1
+            if len(group_rules) + groups > self.max_groups + 1:
+                self._add_alternation(parts, group_rules)
+                parts = []
+                group_rules = [None]
+            group_rules.append(rule)
+            group_rules.extend([None] * (groups - 1))
+            parts.append(_named_group_re.sub(_strip_group_name,
+                                             regex.pattern[1:]))
+        if parts:
+            self._add_alternation(parts, group_rules)
+
+    def _add_alternation(self, parts, group_rules):
+        regex = re.compile(u'^(?:(%s))' % u')|('.join(parts), re.UNICODE)
+        rules = [x for x in group_rules if x is not None]
+        positions = {}
+        for idx, rule in enumerate(group_rules):
+            if rule is not None:
+                positions[idx] = len(positions)
+        self._alternations.append((regex, rules, positions))
+
+    def __getstate__(self):
+        state = RuleMatcher.__getstate__(self)
+        state['_alternations'] = [(_make_lazy(regex), rules, positions)
+                                  for regex, rules, positions
+                                  in self._alternations]
+        return state
+
+    def match(self, subdomain, path):
+        path = u'%s|%s' % (subdomain, path)
+        for regex, rules, positions in self._alternations:
+            m = regex.match(path)
+            if m is None:
+                continue
+            for rule in rules[positions[m.lastindex]:]:
+                rv = rule.match(path)
+                if rv is not None:
+                    yield rule, rv
+
+
+def _cached_conversion(to_python, maxsize):
+    """Wrap a `to_python` method so that the results are remembered in a
+    :class:`MatchCache`.  Rejected values are remembered as well.
+
+    :internal:
+    """
+    cache = MatchCache(maxsize)
+    def convert(value):
+        rv = cache.get(value)
+        if rv is None:
+            try:
+                rv = (to_python(value),)
+            except ValidationError:
+                rv = ()
+            cache.set(value, rv)
+        if not rv:
+            raise ValidationError()
+        return rv[0]
+    return convert
+
+
+class MatchCache(object):
+    """The match cache of a :class:`Map`.  It remembers the outcome of
+    :meth:`MapAdapter.match` for URLs, the matched rule and the converted
+    values or the routing exception raised.  If the cache is full the least
+    recently used quarter of the entries is removed.
+
+    Like the :class:`~werkzeug.contrib.cache.SimpleCache` this class does
+    not use locks.  Under heavy load it could happen that entries are
+    pruned or added twice which is harmless.
+
+    .. versionadded:: 0.6
+
+    :param maxsize: the maximum number of URLs cached.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        #: the number of lookups that were answered from the cache.
+        self.hits = 0
+        #: the number of lookups for URLs that were not in the cache.
+        self.misses = 0
+        self._entries = {}
+        self._ticks = count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _prune(self):
+        entries = self._entries.items()
+        entries.sort(key=lambda x: x[1][0])
+        for key, entry in entries[:len(entries) - self.maxsize * 3 // 4]:
+            self._entries.pop(key, None)
+
+    def get(self, key):
+        """Return the cached outcome for a key or `None`."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        entry[0] = self._ticks.next()
+        return entry[1]
+
+    def set(self, key, value):
+        """Store an outcome in the cache."""
+        if len(self._entries) >= self.maxsize:
+            self._prune()
+        self._entries[key] = [self._ticks.next(), value]
+
+    def clear(self):
+        """Remove all entries from the cache.  The counters are kept."""
+        self._entries.clear()
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._entries = {}
+        self._ticks = count()
+
+
+class MatchStats(object):
+    """Collects statistics about the URL matching of a :class:`Map`.  For
+    every rule it records how often it matched, how many rules are in front
+    of it for the subdomain and method of the requests and how much time
+    :meth:`MapAdapter.match` spent for these requests.  The rules in front
+    of a rule are the ones a linear search has to test before it reaches
+    the rule.  Additionally the URLs that were not found, the ones for which
+    the method was not allowed and the redirects are counted.
+
+    Like the :class:`MatchCache` this class does not use locks.  Under heavy
+    load a few requests might not be counted.
+
+    .. versionadded:: 0.6
+
+    :param map: the :class:`Map` the statistics are collected for.
+    """
+
+    #: the keys :meth:`get_rule_stats` and :meth:`dump` can sort by and
+    #: the positions of the values in the tuples.
+    sort_keys = {'time': 3, 'hits': 1, 'scanned': 2, 'rule': None}
+
+    def __init__(self, map):
+        self.map = map
+        self.reset()
+
+    def reset(self):
+        """Forget all statistics collected so far."""
+        #: the number of URLs that did not match any rule.
+        self.not_found = 0
+        #: the number of URLs that only matched rules for other methods.
+        self.method_not_allowed = 0
+        #: the number of redirects, either because a trailing slash was
+        #: missing, the rule had a `redirect_to` or another rule provides
+        #: the defaults.
+        self.redirects = 0
+        #: the time spent for the URLs that raised one of the exceptions.
+        self.failure_time = 0.0
+        self._rules = {}
+
+    def add_match(self, rule, scanned, elapsed):
+        """Record that `rule` matched after `scanned` other rules and that
+        matching took `elapsed` seconds.
+        """
+        entry = self._rules.get(rule)
+        if entry is None:
+            entry = self._rules[rule] = [0, 0, 0.0]
+        entry[0] += 1
+        entry[1] += scanned
+        entry[2] += elapsed
+
+    def add_failure(self, exception, elapsed):
+        """Record that matching raised the given exception after `elapsed`
+        seconds.
+        """
+        if isinstance(exception, RequestRedirect):
+            self.redirects += 1
+        elif isinstance(exception, MethodNotAllowed):
+            self.method_not_allowed += 1
+        else:
+            self.not_found += 1
+        self.failure_time += elapsed
+
+    def get_rule_stats(self, sort_by='time'):
+        """Return the statistics of all the rules of the map as list of
+        ``(rule, hits, average_scanned, total_time)`` tuples.  Rules that
+        never matched are part of the list as well so that dead rules can
+        be found.
+
+        :param sort_by: ``'time'``, ``'hits'`` or ``'scanned'`` to sort by
+                        the total time, the hits or the average number of
+                        rules scanned in descending order or ``'rule'`` to
+                        keep the order the rules were added to the map.
+        """
+        if sort_by not in self.sort_keys:
+            raise ValueError('cannot sort by %r' % sort_by)
+        idx = self.sort_keys[sort_by]
+        result = []
+        for rule in self.map.iter_rules():
+            hits, scanned, elapsed = self._rules.get(rule, (0, 0, 0.0))
+            result.append((rule, hits, hits and scanned / float(hits) or 0.0,
+                           elapsed))
+        if idx is not None:
+            result.sort(key=lambda x: x[idx], reverse=True)
+        return result
+
+    def dump(self, stream=None, sort_by='time'):
+        """Write a report with the statistics of the rules sorted by
+        `sort_by` (see :meth:`get_rule_stats`) and the number of failed
+        matches to the stream, which defaults to `sys.stdout`.
+        """
+        if stream is None:
+            stream = sys.stdout
+        stream.write('%8s  %8s  %10s  %s\n' % ('hits', 'scanned', 'time',
+                                               'rule'))
+        for rule, hits, scanned, elapsed in self.get_rule_stats(sort_by):
+            stream.write('%8d  %8.1f  %10.4f  %r\n' % (hits, scanned,
+                                                       elapsed, rule))
+        stream.write('\nnot found: %d, method not allowed: %d, '
+                     'redirects: %d, time: %.4f\n' % (
+            self.not_found, self.method_not_allowed, self.redirects,
+            self.failure_time))
+
+
 class Map(object):
     """The map class stores all the URL rules and some configuration
     parameters.  Some of the configuration values are only stored on the
@@ -908,17 +1520,44 @@ class Map(object):
     :param sort_parameters: If set to `True` the url parameters are sorted.
                             See `url_encode` for more details.
     :param sort_key: The sort key function for `url_encode`.
+    :param matcher: the matching engine for the map.  Either the name of one
+                    of the :data:`DEFAULT_MATCHERS` or a :class:`RuleMatcher`
+                    subclass.  Defaults to ``'linear'`` which tests all rules
+                    one after another.  For large maps ``'trie'`` or
+                    ``'regex'`` are a lot faster.
+    :param match_cache_size: if set to a number the outcome of that many URLs
+                             is cached in a :class:`MatchCache` that is
+                             available as :attr:`match_cache`.  Only enable
+                             this if your converters and `redirect_to`
+                             callables return the same value for the same
+                             URL.
+    :param match_stats: if set to `True` statistics about the matched rules
+                        are collected in a :class:`MatchStats` object that
+                        is available as :attr:`match_stats`.
 
     .. versionadded:: 0.5
         `sort_parameters` and `sort_key` was added.
+
+    .. versionadded:: 0.6
+        `matcher`, `match_cache_size` and `match_stats` was added.
     """
 
     def __init__(self, rules=None, default_subdomain='', charset='utf-8',
                  strict_slashes=True, redirect_defaults=True,
-                 converters=None, sort_parameters=False, sort_key=None):
+                 converters=None, sort_parameters=False, sort_key=None,
+                 matcher='linear', match_cache_size=None, match_stats=False):
         self._rules = []
         self._rules_by_endpoint = {}
+        self._match_rules = []
+        self._match_keys = []
+        self._build_keys = {}
+        self._rule_count = 0
         self._remap = True
+        self._remap_endpoints = set()
+        self._subdomains = set()
+        self._methods = set()
+        self._matchers = {}
+        self._restricted_matchers = {}
 
         self.default_subdomain = default_subdomain
         self.charset = charset
@@ -932,6 +1571,24 @@ class Map(object):
         self.sort_parameters = sort_parameters
         self.sort_key = sort_key
 
+        if isinstance(matcher, basestring):
+            if matcher not in DEFAULT_MATCHERS:
+                raise LookupError('the matcher %r does not exist' % matcher)
+            matcher = DEFAULT_MATCHERS[matcher]
+        self.matcher_class = matcher
+
+        #: the :class:`MatchCache` of the map or `None` if caching is
+        #: disabled.
+        self.match_cache = None
+        if match_cache_size:
+            self.match_cache = MatchCache(match_cache_size)
+
+        #: the :class:`MatchStats` of the map or `None` if the statistics
+        #: are disabled.
+        self.match_stats = None
+        if match_stats:
+            self.match_stats = MatchStats(self)
+
         for rulefactory in rules or ():
             self.add(rulefactory)
 
@@ -974,9 +1631,43 @@ class Map(object):
         """
         for rule in rulefactory.get_rules(self):
             rule.bind(self)
+            self._rule_count += 1
+            key = rule.get_match_key(), self._rule_count
+            idx = bisect_right(self._match_keys, key)
+            self._match_keys.insert(idx, key)
+            self._match_rules.insert(idx, rule)
             self._rules.append(rule)
-            self._rules_by_endpoint.setdefault(rule.endpoint, []).append(rule)
+            key = rule.get_build_key(), -self._rule_count
+            keys = self._build_keys.setdefault(rule.endpoint, [])
+            rules = self._rules_by_endpoint.setdefault(rule.endpoint, [])
+            idx = bisect_right(keys, key)
+            # a rule that provides defaults for a build only rule is always
+            # tried first.  The moved rule takes over the key of its new
+            # neighbour so that the keys stay sorted.
+            if rule.build_only:
+                for pos in xrange(len(rules) - 1, idx - 1, -1):
+                    if rules[pos].provides_defaults_for(rule):
+                        idx = pos + 1
+                        key = keys[pos]
+                        break
+            elif rule.defaults is not None:
+                for pos in xrange(idx):
+                    if rules[pos].build_only and \
+                       rule.provides_defaults_for(rules[pos]):
+                        idx = pos
+                        key = keys[pos]
+                        break
+            keys.insert(idx, key)
+            rules.insert(idx, rule)
+            if '<' not in rule.subdomain:
+                self._subdomains.add(rule.subdomain)
+            if rule.methods is not None:
+                self._methods.update(rule.methods)
+            self._drop_matchers(rule)
+            self._remap_endpoints.add(rule.endpoint)
         self._remap = True
+        if self.match_cache is not None:
+            self.match_cache.clear()
 
     def bind(self, server_name, script_name=None, subdomain=None,
              url_scheme='http', default_method='GET', path_info=None):
@@ -1058,16 +1749,186 @@ class Map(object):
                         subdomain, environ['wsgi.url_scheme'],
                         environ['REQUEST_METHOD'], environ.get('PATH_INFO'))
 
+    def save(self, filename, checksum):
+        """Save the map with the sorted rules and the matcher to a file so
+        that it can be loaded again with :meth:`load`.  The file is written
+        to a temporary file first and then renamed so that processes loading
+        the map at the same time never see a half written file.
+
+        All endpoints, converters and callables used by the map (for example
+        the `sort_key` and `redirect_to` functions) must be picklable.
+
+        .. versionadded:: 0.6
+
+        :param filename: the file to save the map to.
+        :param checksum: a string that is stored with the map.  A map is only
+                         loaded if the same checksum is passed to
+                         :meth:`load`.
+        """
+        from tempfile import mkstemp
+        self.update()
+        for subdomain in list(self._subdomains) + [None]:
+            self._get_valid_methods(subdomain, u'/')
+            for method in list(self._methods) + [None]:
+                self._get_matcher(subdomain, method)
+        fd, tmp = mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump((_map_file_version, checksum), f,
+                            pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, filename)
+            except OSError:
+                # windows does not allow renaming over existing files
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                os.rename(tmp, filename)
+        except:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, filename, checksum, factory=None):
+        """Load a map saved with :meth:`save`.  Loading a map is a lot faster
+        than creating it from the rules because the rules are already sorted
+        and the regular expressions are only compiled when they are used.
+        This is useful for prefork servers where every process would
+        otherwise have to create the map on its own::
+
+            def make_url_map():
+                return Map([...])
+
+            url_map = Map.load('/var/cache/myapp/urls', checksum=VERSION,
+                               factory=make_url_map)
+
+        If the file does not exist, was saved with a different checksum or
+        cannot be loaded, the map is created by calling `factory` and saved
+        to the file.  Errors while saving, including maps that cannot be
+        pickled, are ignored in that case.  If no factory is provided `None`
+        is returned instead.
+
+        .. versionadded:: 0.6
+
+        :param filename: the file the map was saved to.
+        :param checksum: the checksum the map was saved with.  Use something
+                         that changes when the rules change, like the version
+                         of your application, so that a stale file is never
+                         loaded.
+        :param factory: an optional function that creates the map if it
+                        cannot be loaded from the file.
+        """
+        map = None
+        try:
+            f = file(filename, 'rb')
+        except IOError:
+            pass
+        else:
+            try:
+                try:
+                    if pickle.load(f) == (_map_file_version, checksum):
+                        map = pickle.load(f)
+                except Exception:
+                    pass
+            finally:
+                f.close()
+        if isinstance(map, cls):
+            return map
+        if factory is None:
+            return None
+        map = factory()
+        try:
+            map.save(filename, checksum)
+        except (IOError, OSError, pickle.PicklingError, TypeError,
+                AttributeError):
+            pass
+        return map
+
     def update(self):
-        """Called before matching and building to keep the compiled rules
-        in the correct order after things changed.
+        """Called before matching and building to update the information
+        that depends on other rules after rules were added.  The rules
+        themselves are inserted at the correct position when they are
+        added so this never has to sort them.
         """
         if self._remap:
-            self._rules.sort(lambda a, b: a.match_compare(b))
-            for rules in self._rules_by_endpoint.itervalues():
-                rules.sort(lambda a, b: a.build_compare(b))
+            for endpoint in self._remap_endpoints:
+                rules = self._rules_by_endpoint[endpoint]
+                for rule in rules:
+                    rule._default_providers = tuple([
+                        (r, r.methods, r.defaults.items()) for r in rules
+                        if r.provides_defaults_for(rule)])
+            self._remap_endpoints.clear()
             self._remap = False
 
+    def _drop_matchers(self, rule):
+        """Forget the matchers the rule belongs to so that they are created
+        again with the new rule on next use.  All other matchers are kept.
+
+        :internal:
+        """
+        dynamic = '<' in rule.subdomain
+        for subdomain, method in self._matchers.keys():
+            if (dynamic or rule.subdomain == subdomain) and \
+               (rule.methods is None or method in rule.methods):
+                del self._matchers[subdomain, method]
+        if rule.methods is not None:
+            for subdomain in self._restricted_matchers.keys():
+                if dynamic or rule.subdomain == subdomain:
+                    del self._restricted_matchers[subdomain]
+
+    def _get_matcher(self, subdomain, method):
+        """Return the matcher for the rules that can match URLs on the given
+        subdomain with the given method.  Rules for other subdomains and
+        rules that do not accept the method are not part of it.  The
+        matchers are created on first use.
+
+        :internal:
+        """
+        if subdomain not in self._subdomains:
+            subdomain = None
+        if method not in self._methods:
+            method = None
+        matcher = self._matchers.get((subdomain, method))
+        if matcher is None:
+            rules = [rule for rule in self._match_rules
+                     if (rule.subdomain == subdomain or
+                         '<' in rule.subdomain) and
+                        (rule.methods is None or method in rule.methods)]
+            matcher = self.matcher_class(self, rules)
+            self._matchers[subdomain, method] = matcher
+        return matcher
+
+    def _get_valid_methods(self, subdomain, path):
+        """Return the methods of the rules with a method restriction that
+        match the path on the given subdomain.  Used for the
+        :exc:`MethodNotAllowed` exception if there was no match for the
+        method of the request.
+
+        :internal:
+        """
+        key = subdomain
+        if key not in self._subdomains:
+            key = None
+        matcher = self._restricted_matchers.get(key)
+        if matcher is None:
+            rules = [rule for rule in self._match_rules
+                     if (rule.subdomain == key or '<' in rule.subdomain) and
+                        rule.methods is not None]
+            matcher = self._restricted_matchers[key] = \
+                self.matcher_class(self, rules)
+        valid_methods = set()
+        for rule, rv in matcher.match(subdomain, path):
+            valid_methods.update(rule.methods)
+        return valid_methods
+
 
 class MapAdapter(object):
     """Returned by :meth:`Map.bind` or :meth:`Map.bind_to_environ` and does
@@ -1213,59 +2074,105 @@ class MapAdapter(object):
         if not isinstance(path_info, unicode):
             path_info = path_info.decode(self.map.charset, 'ignore')
         method = (method or self.default_method).upper()
-        path = u'%s|/%s' % (self.subdomain, path_info.lstrip('/'))
-        have_match_for = set()
-        for rule in self.map._rules:
+
+        stats = self.map.match_stats
+        if stats is None:
+            rule, rv = self._match_cached(path_info, method)
+        else:
+            start = time()
             try:
-                rv = rule.match(path)
-            except RequestSlash:
-                raise RequestRedirect(str('%s://%s%s%s/%s/' % (
-                    self.url_scheme,
-                    self.subdomain and self.subdomain + '.' or '',
-                    self.server_name,
-                    self.script_name[:-1],
-                    url_quote(path_info.lstrip('/'), self.map.charset)
-                )))
-            if rv is None:
-                continue
-            if rule.methods is not None and method not in rule.methods:
-                have_match_for.update(rule.methods)
-                continue
-            if self.map.redirect_defaults:
-                for r in self.map._rules_by_endpoint[rule.endpoint]:
-                    if r.provides_defaults_for(rule) and \
-                       r.suitable_for(rv, method):
-                        rv.update(r.defaults)
-                        subdomain, path = r.build(rv)
-                        raise RequestRedirect(str('%s://%s%s%s/%s' % (
-                            self.url_scheme,
-                            subdomain and subdomain + '.' or '',
-                            self.server_name,
-                            self.script_name[:-1],
-                            url_quote(path.lstrip('/'), self.map.charset)
-                        )))
-            if rule.redirect_to is not None:
-                if isinstance(rule.redirect_to, basestring):
-                    def _handle_match(match):
-                        value = rv[match.group(1)]
-                        return rule._converters[match.group(1)].to_url(value)
-                    redirect_url = _simple_rule_re.sub(_handle_match,
-                                                       rule.redirect_to)
+                rule, rv = self._match_cached(path_info, method)
+            except HTTPException, e:
+                stats.add_failure(e, time() - start)
+                raise
+            matcher = self.map._get_matcher(self.subdomain, method)
+            stats.add_match(rule, matcher.get_position(rule), time() - start)
+
+        if return_rule:
+            return rule, rv
+        return rule.endpoint, rv
+
+    def _match_cached(self, path_info, method):
+        """Looks up the path in the match cache of the map if there is one
+        and falls back to :meth:`_match`.
+        """
+        cache = self.map.match_cache
+        if cache is None:
+            return self._match(path_info, method)
+        else:
+            key = (self.url_scheme, self.server_name, self.script_name,
+                   self.subdomain, path_info, method)
+            result = cache.get(key)
+            if result is None:
+                try:
+                    result = self._match(path_info, method)
+                except HTTPException, e:
+                    result = e
+                cache.set(key, result)
+            if isinstance(result, HTTPException):
+                raise result
+            rule, rv = result
+            return rule, dict(rv)
+
+    def _match(self, path_info, method):
+        """Does the actual matching for :meth:`match` and returns the
+        matched rule and the values as tuple.
+        """
+        path = u'/' + path_info.lstrip('/')
+        matcher = self.map._get_matcher(self.subdomain, method)
+        try:
+            for rule, rv in matcher.match(self.subdomain, path):
+                break
+            else:
+                valid_methods = self.map._get_valid_methods(self.subdomain,
+                                                            path)
+                if valid_methods:
+                    raise MethodNotAllowed(valid_methods=list(valid_methods))
+                raise NotFound()
+        except RequestSlash:
+            raise RequestRedirect(str('%s://%s%s%s/%s/' % (
+                self.url_scheme,
+                self.subdomain and self.subdomain + '.' or '',
+                self.server_name,
+                self.script_name[:-1],
+                url_quote(path_info.lstrip('/'), self.map.charset)
+            )))
+        if self.map.redirect_defaults:
+            # the rules providing defaults have the same arguments as the
+            # matched rule so only the method and the values of the defaults
+            # have to be checked.  see Rule.suitable_for
+            for r, methods, defaults in rule._default_providers:
+                if methods is not None and method not in methods:
+                    continue
+                for key, value in defaults:
+                    if value != rv[key]:
+                        break
                 else:
-                    redirect_url = rule.redirect_to(self, **rv)
-                raise RequestRedirect(str(urljoin('%s://%s%s%s' % (
-                    self.url_scheme,
-                    self.subdomain and self.subdomain + '.' or '',
-                    self.server_name,
-                    self.script_name
-                ), redirect_url)))
-            if return_rule:
-                return rule, rv
+                    rv.update(r.defaults)
+                    subdomain, path = r.build(rv)
+                    raise RequestRedirect(str('%s://%s%s%s/%s' % (
+                        self.url_scheme,
+                        subdomain and subdomain + '.' or '',
+                        self.server_name,
+                        self.script_name[:-1],
+                        url_quote(path.lstrip('/'), self.map.charset)
+                    )))
+        if rule.redirect_to is not None:
+            if isinstance(rule.redirect_to, basestring):
+                def _handle_match(match):
+                    value = rv[match.group(1)]
+                    return rule._converters[match.group(1)].to_url(value)
+                redirect_url = _simple_rule_re.sub(_handle_match,
+                                                   rule.redirect_to)
             else:
-                return rule.endpoint, rv
-        if have_match_for:
-            raise MethodNotAllowed(valid_methods=list(have_match_for))
-        raise NotFound()
+                redirect_url = rule.redirect_to(self, **rv)
+            raise RequestRedirect(str(urljoin('%s://%s%s%s' % (
+                self.url_scheme,
+                self.subdomain and self.subdomain + '.' or '',
+                self.server_name,
+                self.script_name
+            ), redirect_url)))
+        return rule, rv
 
     def test(self, path_info=None, method=None):
         """Test if a rule would match.  Works like `match` but returns `True`
@@ -1333,10 +2240,7 @@ class MapAdapter(object):
         """
         self.map.update()
         method = method or self.default_method
-        if values:
-            values = dict([(k, v) for k, v in values.items() if v is not None])
-        else:
-            values = {}
+        values = _drop_none_values(values)
 
         for rule in self.map._rules_by_endpoint.get(endpoint, ()):
             if rule.suitable_for(values, method):
@@ -1347,7 +2251,7 @@ class MapAdapter(object):
             raise BuildError(endpoint, values, method)
         subdomain, path = rv
         if not force_external and subdomain == self.subdomain:
-            return str(urljoin(self.script_name, path.lstrip('/')))
+            return str(_join_script_path(self.script_name, path))
         return str('%s://%s%s%s/%s' % (
             self.url_scheme,
             subdomain and subdomain + '.' or '',
@@ -1356,6 +2260,71 @@ class MapAdapter(object):
             path.lstrip('/')
         ))
 
+    def make_builder(self, endpoint, method=None, force_external=False):
+        """Return a function that builds URLs for an endpoint.  It works like
+        :meth:`build` but the rules and the URL prefixes are looked up only
+        once which makes it a lot faster if many URLs for the same endpoint
+        are built, for example for listings:
+
+        >>> m = Map([Rule('/downloads/<int:id>', endpoint='downloads/show')])
+        >>> urls = m.bind("example.com", "/")
+        >>> build = urls.make_builder("downloads/show")
+        >>> [build({'id': id}) for id in 1, 2]
+        ['/downloads/1', '/downloads/2']
+
+        The returned function accepts the values as only argument and raises
+        a :exc:`BuildError` if no URL can be built for them.  Rules that are
+        added to the map after the function was created are ignored by it.
+
+        .. versionadded:: 0.6
+
+        :param endpoint: the endpoint of the URLs to build.
+        :param method: the HTTP method for the rule if there are different
+                       URLs for different methods on the same endpoint.
+        :param force_external: enforce full canonical external URLs.
+        """
+        self.map.update()
+        method = method or self.default_method
+        rules = [rule for rule in self.map._rules_by_endpoint.get(endpoint, ())
+                 if rule.methods is None or method in rule.methods]
+        current_subdomain = self.subdomain
+        script_name = self.script_name
+        url_scheme = self.url_scheme + '://'
+        url_root = self.server_name + self.script_name
+
+        def build(values=None):
+            values = _drop_none_values(values)
+            for rule in rules:
+                if rule.suitable_for(values, method):
+                    rv = rule.build(values)
+                    if rv is not None:
+                        break
+            else:
+                raise BuildError(endpoint, values, method)
+            subdomain, path = rv
+            if not force_external and subdomain == current_subdomain:
+                return str(_join_script_path(script_name, path))
+            return str(url_scheme + (subdomain and subdomain + '.' or '') +
+                       url_root + path.lstrip('/'))
+        return build
+
+    def build_many(self, endpoint, iterable, method=None,
+                   force_external=False):
+        """Build one URL for every dict of values in the iterable and return
+        an iterator over the URLs.  This uses :meth:`make_builder` so that the
+        rules are looked up only once.
+
+        .. versionadded:: 0.6
+
+        :param endpoint: the endpoint of the URLs to build.
+        :param iterable: an iterable of dicts with the values for the URLs.
+        :param method: the HTTP method for the rule if there are different
+                       URLs for different methods on the same endpoint.
+        :param force_external: enforce full canonical external URLs.
+        """
+        return imap(self.make_builder(endpoint, method, force_external),
+                    iterable)
+
 
 #: the default converter mapping for the map.
 DEFAULT_CONVERTERS = {
@@ -1366,3 +2335,10 @@ DEFAULT_CONVERTERS = {
     'int':              IntegerConverter,
     'float':            FloatConverter
 }
+
+#: the builtin matching engines.  See :class:`RuleMatcher`.
+DEFAULT_MATCHERS = {
+    'linear':           LinearMatcher,
+    'trie':             TrieMatcher,
+    'regex':            RegexMatcher
+}
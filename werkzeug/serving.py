@@ -36,7 +36,9 @@
     :license: BSD, see LICENSE for more details.
 """
 import os
+import errno
 import socket
+import select
 import sys
 import time
 import thread
@@ -50,6 +52,21 @@ from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 import werkzeug
 from werkzeug._internal import _log
 from werkzeug.exceptions import InternalServerError
+from werkzeug.wsgi import FileWrapper
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+
+class _ServerFileWrapper(FileWrapper):
+    """The file wrapper the server provides as `wsgi.file_wrapper`.  Files
+    wrapped in it are sent with :func:`os.sendfile` if possible.
+    """
 
 
 class WSGIRequestHandler(BaseHTTPRequestHandler, object):
@@ -70,6 +87,7 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
             'wsgi.multithread':     self.server.multithread,
             'wsgi.multiprocess':    self.server.multiprocess,
             'wsgi.run_once':        False,
+            'wsgi.file_wrapper':    _ServerFileWrapper,
             'SERVER_SOFTWARE':      self.server_version,
             'REQUEST_METHOD':       self.command,
             'SCRIPT_NAME':          '',
@@ -133,11 +151,50 @@ class WSGIRequestHandler(BaseHTTPRequestHandler, object):
             headers_set[:] = [status, response_headers]
             return write
 
+        def send_file(file):
+            # files are sent with sendfile from their current position up to
+            # the content length if the connection is not encrypted and the
+            # file has a file descriptor.  Otherwise we iterate over them.
+            if sendfile is None or self.server.ssl_context is not None or \
+               not headers_set:
+                return False
+            try:
+                in_fd = file.fileno()
+                offset = file.tell()
+            except (AttributeError, IOError, ValueError):
+                return False
+            length = None
+            for key, value in headers_set[1]:
+                if key.lower() == 'content-length':
+                    try:
+                        length = int(value)
+                    except ValueError:
+                        pass
+            if length is None or length < 0:
+                length = os.fstat(in_fd).st_size - offset
+            write('')
+            out_fd = self.connection.fileno()
+            while length > 0:
+                try:
+                    sent = sendfile(out_fd, in_fd, offset, length)
+                except OSError, e:
+                    if e.errno == errno.EAGAIN:
+                        select.select([], [out_fd], [])
+                        continue
+                    raise socket.error(e.errno, e.strerror)
+                if not sent:
+                    break
+                offset += sent
+                length -= sent
+            return True
+
         def execute(app):
             application_iter = app(environ, start_response)
             try:
-                for data in application_iter:
-                    write(data)
+                if not isinstance(application_iter, _ServerFileWrapper) or \
+                   not send_file(application_iter.file):
+                    for data in application_iter:
+                        write(data)
                 # make sure the headers are sent
                 if not headers_sent:
                     write('')
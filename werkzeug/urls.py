@@ -23,14 +23,31 @@ _hextochr = dict(('%02x' % i, chr(i)) for i in xrange(256))
 _hextochr.update(('%02X' % i, chr(i)) for i in xrange(256))
 
 
-def _quote(s, safe='/', _quotechar='%%%02X'.__mod__):
-    assert isinstance(s, str), 'quote only works on bytes'
+#: quoting tables for :func:`_quote` by safe characters.
+_quote_tables = {}
+
+
+def _get_quote_table(safe, _quotechar='%%%02X'.__mod__):
     safe = _always_safe | set(safe)
-    rv = list(s)
-    for idx, char in enumerate(s):
-        if char not in safe:
-            rv[idx] = _quotechar(ord(char))
-    return ''.join(rv)
+    table = {}
+    for idx in xrange(256):
+        char = chr(idx)
+        if char in safe:
+            table[char] = char
+        else:
+            table[char] = _quotechar(idx)
+    return ''.join(safe), table
+
+
+def _quote(s, safe='/'):
+    assert isinstance(s, str), 'quote only works on bytes'
+    try:
+        safe_chars, table = _quote_tables[safe]
+    except KeyError:
+        safe_chars, table = _quote_tables[safe] = _get_quote_table(safe)
+    if not s.rstrip(safe_chars):
+        return s
+    return ''.join(map(table.__getitem__, s))
 
 
 def _quote_plus(s, safe=''):
@@ -206,8 +223,85 @@ def url_decode(s, charset='utf-8', decode_keys=False, include_empty=True,
     """
     if cls is None:
         cls = MultiDict
-    result = []
-    for pair in str(s).split(separator):
+    return cls(_url_decode_impl(str(s).split(separator), charset,
+                                decode_keys, errors))
+
+
+def url_decode_stream(stream, charset='utf-8', decode_keys=False,
+                      include_empty=True, errors='ignore', separator='&',
+                      cls=None, limit=None, max_pairs=None,
+                      buffer_size=10 * 1024):
+    """Works like :func:`url_decode` but decodes the pairs from a stream
+    while it is read in blocks of `buffer_size` bytes instead of reading
+    the whole data into memory first.  If the input stream is not a
+    :class:`LimitedStream` the `limit` parameter is mandatory.
+
+    .. versionadded:: 0.6
+
+    :param stream: the stream to decode the pairs from.
+    :param limit: the limit in bytes for the stream.  (Usually content
+                  length.  Not necessary if the `stream` is a
+                  :class:`LimitedStream`.
+    :param max_pairs: the maximum number of pairs.  If there are more an
+                      :exc:`~exceptions.RequestEntityTooLarge` exception is
+                      raised before the rest of the stream is decoded.
+    :param buffer_size: the size of the blocks read from the stream.
+
+    The other parameters are the same as for :func:`url_decode`.
+    """
+    if cls is None:
+        cls = MultiDict
+    if not isinstance(stream, LimitedStream):
+        if limit is None:
+            raise TypeError('stream not limited and no limit provided.')
+        stream = LimitedStream(stream, limit)
+    pairs = _iter_pairs(stream, separator, buffer_size)
+    if max_pairs is not None:
+        pairs = _limit_pairs(pairs, max_pairs)
+    return cls(_url_decode_impl(pairs, charset, decode_keys, errors))
+
+
+def _iter_pairs(stream, separator, buffer_size):
+    """Yields the separated pairs from a stream."""
+    _read = stream.read
+    pending = []
+    while 1:
+        chunk = _read(buffer_size)
+        if not chunk:
+            break
+        if separator not in chunk:
+            pending.append(chunk)
+            continue
+        pairs = chunk.split(separator)
+        if pending:
+            pending.append(pairs[0])
+            pairs[0] = ''.join(pending)
+        pending = [pairs.pop()]
+        for pair in pairs:
+            yield pair
+    if pending:
+        yield ''.join(pending)
+
+
+def _limit_pairs(pairs, max_pairs):
+    """Passes on the non-empty pairs and raises an
+    :exc:`~exceptions.RequestEntityTooLarge` exception if there are more
+    than `max_pairs`.
+    """
+    count = 0
+    for pair in pairs:
+        if pair:
+            count += 1
+            if count > max_pairs:
+                raise RequestEntityTooLarge()
+            yield pair
+
+
+def _url_decode_impl(pairs, charset, decode_keys, errors):
+    """Decodes the pairs into ``(key, value)`` tuples.  Keys and values
+    without ``%`` and ``+`` are not unquoted.
+    """
+    for pair in pairs:
         if not pair:
             continue
         if '=' in pair:
@@ -215,11 +309,13 @@ def url_decode(s, charset='utf-8', decode_keys=False, include_empty=True,
         else:
             key = pair
             value = ''
-        key = _unquote_plus(key)
+        if '%' in key or '+' in key:
+            key = _unquote_plus(key)
         if decode_keys:
             key = _decode_unicode(key, charset, errors)
-        result.append((key, url_unquote_plus(value, charset, errors)))
-    return cls(result)
+        if '%' in value or '+' in value:
+            value = _unquote_plus(value)
+        yield key, _decode_unicode(value, charset, errors)
 
 
 def url_encode(obj, charset='utf-8', encode_keys=False, sort=False, key=None,
@@ -449,3 +545,5 @@ class Href(object):
 
 # circular dependencies
 from werkzeug.datastructures import MultiDict
+from werkzeug.wsgi import LimitedStream
+from werkzeug.exceptions import RequestEntityTooLarge
@@ -20,6 +20,7 @@
     :copyright: (c) 2009 by the Werkzeug Team, see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
+import os
 import tempfile
 import urlparse
 from datetime import datetime, timedelta
@@ -29,13 +30,14 @@ from werkzeug.http import HTTP_STATUS_CODES, \
      parse_date, generate_etag, is_resource_modified, unquote_etag, \
      quote_etag, parse_set_header, parse_authorization_header, \
      parse_www_authenticate_header, remove_entity_headers, \
-     parse_options_header, dump_options_header
+     parse_options_header, dump_options_header, get_requested_ranges
 from werkzeug.urls import url_decode, iri_to_uri
 from werkzeug.formparser import parse_form_data, default_stream_factory
 from werkzeug.utils import cached_property, environ_property, \
      cookie_date, parse_cookie, dump_cookie, http_date, escape, \
      header_property, get_content_type
-from werkzeug.wsgi import get_current_url, get_host, LimitedStream
+from werkzeug.wsgi import get_current_url, get_host, LimitedStream, \
+     wrap_file, wrap_file_ranges
 from werkzeug.datastructures import MultiDict, CombinedMultiDict, Headers, \
      EnvironHeaders, ImmutableMultiDict, ImmutableTypeConversionDict, \
      ImmutableList, MIMEAccept, CharsetAccept, LanguageAccept, \
@@ -132,6 +134,36 @@ class BaseRequest(object):
     #: .. versionadded:: 0.5
     max_form_memory_size = None
 
+    #: the maximum size of a single multipart form field that is not a
+    #: file.  This is forwarded to the form data parsing function
+    #: (:func:`parse_form_data`).  When set and the :attr:`form` or
+    #: :attr:`files` attribute is accessed and a field is longer than the
+    #: specified value a :exc:`~exceptions.RequestEntityTooLarge`
+    #: exception is raised.
+    #:
+    #: .. versionadded:: 0.6
+    max_form_field_size = None
+
+    #: the maximum number of form fields and files.  This is forwarded to
+    #: the form data parsing function (:func:`parse_form_data`).  When set
+    #: and the :attr:`form` or :attr:`files` attribute is accessed and more
+    #: fields were transmitted a :exc:`~exceptions.RequestEntityTooLarge`
+    #: exception is raised.
+    #:
+    #: .. versionadded:: 0.6
+    max_form_parts = None
+
+    #: an optional dict that maps the names of file fields to handlers
+    #: that receive the uploaded data while it is parsed instead of the
+    #: stream returned by :meth:`_get_file_stream`.  This is forwarded to
+    #: the form data parsing function (:func:`parse_form_data`) and has
+    #: to be set before :attr:`form` or :attr:`files` is accessed::
+    #:
+    #:     request.file_handlers = {'upload': storage.open_upload}
+    #:
+    #: .. versionadded:: 0.6
+    file_handlers = None
+
     def __init__(self, environ, populate_request=True, shallow=False):
         self.environ = environ
         if populate_request and not shallow:
@@ -216,10 +248,17 @@ class BaseRequest(object):
         This must provide a file-like class with `read()`, `readline()`
         and `seek()` methods that is both writeable and readable.
 
-        The default implementation returns a temporary file if the total
-        content length is higher than 500KB.  Because many browsers do not
-        provide a content length for the files only the total content
-        length matters.
+        The default implementation returns a
+        :class:`~werkzeug.formparser.SpooledStream` that keeps the file in
+        memory until it grows larger than 500KB and moves it into a
+        temporary file afterwards.  Override this method and call
+        :func:`~werkzeug.formparser.default_stream_factory` with a
+        different `max_memory_size` or a
+        :class:`~werkzeug.formparser.TemporaryFilePool` to change that.
+
+        .. versionchanged:: 0.6
+           The limit is applied per file and no longer based on the total
+           content length.
 
         .. versionchanged:: 0.5
            Previously this function was not passed any arguments.  In 0.5 older
@@ -262,7 +301,10 @@ class BaseRequest(object):
                                        self.max_form_memory_size,
                                        self.max_content_length,
                                        cls=ImmutableMultiDict,
-                                       silent=False)
+                                       silent=False,
+                                       file_handlers=self.file_handlers,
+                                       max_form_field_size=self.max_form_field_size,
+                                       max_form_parts=self.max_form_parts)
             except ValueError, e:
                 self._form_parsing_failed(e)
         else:
@@ -812,7 +854,8 @@ class BaseResponse(object):
 
         If the request method is `HEAD` or the status code is in a range
         where the HTTP specification requires an empty response, an empty
-        iterable is returned.
+        iterable is returned.  If the response is a file it's wrapped with
+        :func:`wrap_file` so that the WSGI server can send it directly.
 
         .. versionadded:: 0.6
 
@@ -824,6 +867,8 @@ class BaseResponse(object):
             return ()
         if self.direct_passthrough:
             return self.response
+        if hasattr(self.response, 'read'):
+            return wrap_file(environ, self.response)
         return self.iter_encoded()
 
     def get_wsgi_response(self, environ):
@@ -1035,6 +1080,62 @@ class ETagResponseMixin(object):
                 self.status_code = 304
         return self
 
+    def make_partial(self, request_or_environ, length=None):
+        """Make a response with a file as body partial to the `Range` header
+        of the request.  If a single range is requested the file is seeked
+        to its start and only that range is read, multiple ranges are sent
+        as ``multipart/byteranges``.  If no range is satisfiable the status
+        is set to 416.  Otherwise, or if the response has no seekable file
+        as body, the response is left unchanged except for the
+        `Accept-Ranges` header.
+
+        Set the etag and last modification date before calling this method
+        so that the `If-Range` header of the request can be checked.
+
+        Returns self so that you can do ``return resp.make_partial(req)``
+        but modifies the object in-place.
+
+        .. versionadded:: 0.6
+
+        :param request_or_environ: a request object or WSGI environment to be
+                                   used to make the response partial.
+        :param length: the length of the file.  If not given the
+                       `Content-Length` header or the size of the file on
+                       the file system is used.
+        """
+        environ = getattr(request_or_environ, 'environ', request_or_environ)
+        file = self.response
+        if self.status_code != 200 or not hasattr(file, 'seek'):
+            return self
+        if length is None:
+            length = self.headers.get('content-length', type=int)
+        if length is None:
+            try:
+                length = os.fstat(file.fileno()).st_size
+            except (AttributeError, IOError, OSError):
+                return self
+        self.headers['Accept-Ranges'] = 'bytes'
+        ranges = get_requested_ranges(environ, length,
+                                      self.headers.get('etag'),
+                                      self.headers.get('last-modified'))
+        if ranges is None:
+            return self
+        if not ranges:
+            file.close()
+            self.response = []
+            self.status_code = 416
+            self.headers['Content-Length'] = '0'
+            self.headers['Content-Range'] = 'bytes */%d' % length
+            return self
+        content_type = self.headers.get('content-type')
+        self.response, headers = wrap_file_ranges(environ, file, ranges,
+                                                  length, content_type)
+        for key, value in headers:
+            self.headers[key] = value
+        self.status_code = 206
+        self.direct_passthrough = True
+        return self
+
     def add_etag(self, overwrite=False, weak=False):
         """Add an etag for the current response if there is none yet."""
         if overwrite or 'etag' not in self.headers:
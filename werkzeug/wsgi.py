@@ -13,9 +13,17 @@ import urllib
 import urlparse
 import posixpath
 import mimetypes
+from gzip import GzipFile
+from fnmatch import fnmatch
+from tempfile import mkstemp
 from zlib import adler32
 from time import time, mktime
+from random import random
 from datetime import datetime
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 from werkzeug._internal import _patch_wrapper
 
@@ -247,6 +255,12 @@ def extract_path_info(environ_or_baseurl, path_or_url, charset='utf-8',
     return u'/' + cur_path[len(base_path):].lstrip(u'/')
 
 
+#: the mimetypes :class:`SharedDataMiddleware` compresses on the fly by default
+DEFAULT_GZIP_MIMETYPES = ('text/*', 'application/javascript',
+                          'application/x-javascript', 'application/json',
+                          'application/xml', 'image/svg+xml')
+
+
 class SharedDataMiddleware(object):
     """A WSGI middleware that provides static content for development
     environments or simple server setups. Usage is quite simple::
@@ -275,6 +289,9 @@ class SharedDataMiddleware(object):
     This will then serve the ``shared_files`` folder in the `myapplication`
     Python package.
 
+    If the path of a request is below more than one export the most
+    specific export is asked for the file first.
+
     The optional `disallow` parameter can be a list of :func:`~fnmatch.fnmatch`
     rules for files that are not accessible from the web.  If `cache` is set to
     `False` no caching headers are sent.
@@ -291,8 +308,27 @@ class SharedDataMiddleware(object):
     .. versionchanged:: 0.5
        The cache timeout is configurable now.
 
+    Files from the file system are sent partially if the request has a
+    `Range` header.
+
+    If `metadata_cache_timeout` is set the middleware remembers which file
+    is served for a path together with the headers for it for that many
+    seconds.  Within that time a request only opens the file and checks
+    if its size and modification time are unchanged.  At most
+    `metadata_cache_size` paths are remembered, if there are more the
+    expired ones and then the ones expiring next are forgotten.
+
+    If `gzip` is `True` and the client accepts gzip encoded responses, a
+    file with the same name and an additional ``.gz`` extension is sent
+    instead of the requested file if it exists.  If `gzip_cache_dir` is set
+    files with one of the `gzip_mimetypes` that have no such file are
+    compressed on the first request into that folder.  If the folder grows
+    larger than `gzip_cache_size` bytes the oldest files are removed, files
+    larger than that are never compressed on the fly.
+
     .. versionadded:: 0.6
-       The `fallback_mimetype` parameter was added.
+       The `fallback_mimetype`, `metadata_cache_timeout`,
+       `metadata_cache_size` and `gzip` parameters were added.
 
     :param app: the application to wrap.  If you don't want to wrap an
                 application you can pass it :exc:`NotFound`.
@@ -301,17 +337,39 @@ class SharedDataMiddleware(object):
     :param fallback_mimetype: the fallback mimetype for unknown files.
     :param cache: enable or disable caching headers.
     :Param cache_timeout: the cache timeout in seconds for the headers.
+    :param metadata_cache_timeout: the number of seconds the file lookup and
+                                   headers for a path are cached.  If not
+                                   given nothing is cached.
+    :param metadata_cache_size: the maximum number of cached lookups.
+    :param gzip: enable or disable sending gzip compressed files.
+    :param gzip_cache_dir: the folder for files compressed on the fly.  If
+                           not given no files are compressed on the fly.
+    :param gzip_cache_size: the maximum size of the `gzip_cache_dir` in
+                            bytes.
+    :param gzip_mimetypes: a list of :func:`~fnmatch.fnmatch` rules for the
+                           mimetypes that are compressed on the fly.
     """
 
     # this class is public
     __module__ = 'werkzeug'
 
     def __init__(self, app, exports, disallow=None, cache=True,
-                 cache_timeout=60 * 60 * 12, fallback_mimetype='text/plain'):
+                 cache_timeout=60 * 60 * 12, fallback_mimetype='text/plain',
+                 metadata_cache_timeout=None, metadata_cache_size=1000,
+                 gzip=False, gzip_cache_dir=None,
+                 gzip_cache_size=1024 * 1024 * 50,
+                 gzip_mimetypes=DEFAULT_GZIP_MIMETYPES):
         self.app = app
         self.exports = {}
         self.cache = cache
         self.cache_timeout = cache_timeout
+        self.metadata_cache_timeout = metadata_cache_timeout
+        self.metadata_cache_size = metadata_cache_size
+        self._metadata_cache = {}
+        self.gzip = gzip
+        self.gzip_cache_dir = gzip_cache_dir
+        self.gzip_cache_size = gzip_cache_size
+        self.gzip_mimetypes = gzip_mimetypes
         for key, value in exports.iteritems():
             if isinstance(value, tuple):
                 loader = self.get_package_loader(*value)
@@ -323,11 +381,48 @@ class SharedDataMiddleware(object):
             else:
                 raise TypeError('unknown def %r' % value)
             self.exports[key] = loader
+        self._export_tree = self._build_export_tree(self.exports)
         if disallow is not None:
-            from fnmatch import fnmatch
             self.is_allowed = lambda x: not fnmatch(x, disallow)
         self.fallback_mimetype = fallback_mimetype
 
+    def _build_export_tree(self, exports):
+        """Builds a tree from the exports.  Every node is a dict that maps
+        path segments to the child nodes and `None` to the loader of the
+        export at that node, if there is one.
+        """
+        tree = {}
+        for key, loader in exports.iteritems():
+            node = tree
+            for segment in key.split('/'):
+                if segment:
+                    node = node.setdefault(segment, {})
+            node[None] = loader
+        return tree
+
+    def _find_file(self, path):
+        """Looks up the file for a path and returns it as tuple in the form
+        ``(real_filename, file_loader)``.  The exports the path is below are
+        tried from the most to the least specific one.
+        """
+        segments = path.split('/')[1:]
+        node = self._export_tree
+        loaders = []
+        if None in node:
+            loaders.append((0, node[None]))
+        for depth, segment in enumerate(segments):
+            node = node.get(segment)
+            if node is None:
+                break
+            if None in node:
+                loaders.append((depth + 1, node[None]))
+        for depth, loader in reversed(loaders):
+            real_filename, file_loader = loader('/'.join(segments[depth:])
+                                                or None)
+            if file_loader is not None:
+                return real_filename, file_loader
+        return None, None
+
     def is_allowed(self, filename):
         """Subclasses can override this method to disallow the access to
         certain files.  However by providing `disallow` in the constructor
@@ -336,11 +431,12 @@ class SharedDataMiddleware(object):
         return True
 
     def _opener(self, filename):
-        return lambda: (
-            open(filename, 'rb'),
-            datetime.utcfromtimestamp(os.path.getmtime(filename)),
-            int(os.path.getsize(filename))
-        )
+        def opener():
+            f = open(filename, 'rb')
+            stat = os.fstat(f.fileno())
+            return f, datetime.utcfromtimestamp(stat.st_mtime), \
+                   int(stat.st_size)
+        return opener
 
     def get_file_loader(self, filename):
         return lambda x: (os.path.basename(filename), self._opener(filename))
@@ -393,48 +489,303 @@ class SharedDataMiddleware(object):
                 cleaned_path = cleaned_path.replace(sep, '/')
         path = '/'.join([''] + [x for x in cleaned_path.split('/')
                                 if x and x != '..'])
-        file_loader = None
-        for search_path, loader in self.exports.iteritems():
-            if search_path == path:
-                real_filename, file_loader = loader(None)
-                if file_loader is not None:
-                    break
-            if not search_path.endswith('/'):
-                search_path += '/'
-            if path.startswith(search_path):
-                real_filename, file_loader = loader(path[len(search_path):])
-                if file_loader is not None:
-                    break
-        if file_loader is None or not self.is_allowed(real_filename):
-            return self.app(environ, start_response)
+        accepts_gzip = self.gzip and parse_accept_header(
+            environ.get('HTTP_ACCEPT_ENCODING')).quality('gzip') > 0
+        f = None
+        vary = False
+        if accepts_gzip:
+            f, mtime, file_size, entry = self._open_file(path, 'gzip')
+        if f is None:
+            f, mtime, file_size, entry = self._open_file(path)
+            if f is None:
+                return self.app(environ, start_response)
+            vary = self.gzip and self._has_gzip_variant(path, entry)
+            if accepts_gzip and self._can_compress(entry):
+                f, mtime, file_size, entry = self._compress_file(path, f,
+                                                                 entry)
+
+        etag, headers = entry[5:]
+        headers = [('Date', http_date())] + headers
+        if vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if self.cache:
+            if not is_resource_modified(environ, etag, last_modified=mtime):
+                f.close()
+                start_response('304 Not Modified', headers[:3] +
+                               [x for x in headers if x[0] == 'Vary'])
+                return []
+            headers.insert(3, ('Expires', http_date(time() +
+                                                    self.cache_timeout)))
+
+        # files from the file system can be sent partially.  The ranges
+        # replace the content headers of the whole file.
+        if file_size:
+            ranges = get_requested_ranges(environ, file_size, etag, mtime)
+            if ranges is not None:
+                content_type = dict(headers)['Content-Type']
+                headers = [(key, value) for key, value in headers
+                           if key not in ('Content-Type', 'Content-Length')]
+                if not ranges:
+                    f.close()
+                    headers.append(('Content-Length', '0'))
+                    headers.append(('Content-Range', 'bytes */%d' % file_size))
+                    start_response('416 Requested Range Not Satisfiable',
+                                   headers)
+                    return []
+                app_iter, range_headers = wrap_file_ranges(environ, f, ranges,
+                                                           file_size,
+                                                           content_type)
+                start_response('206 Partial Content', headers + range_headers)
+                return app_iter
 
+        start_response('200 OK', headers)
+        return wrap_file(environ, f)
+
+    def _open_file(self, path, encoding=None):
+        """Opens the file for a path and returns it as tuple in the form
+        ``(f, mtime, file_size, entry)`` where `entry` is the metadata cache
+        entry of the file.  If `encoding` is ``'gzip'`` the precompressed
+        file with an additional ``.gz`` extension is opened instead.  If
+        there is no such file all items are `None`.
+
+        Entries of compressed files without a `file_loader` mean that there
+        is no precompressed file.  They are only cached by
+        :meth:`_has_gzip_variant` and :meth:`_compress_file` once the file
+        itself was found and either hold nothing else or the file compressed
+        by :meth:`_compress_file`.
+        """
+        key = path
+        if encoding is not None:
+            key = (path, encoding)
+            path += '.gz'
+
+        # if the file for the path is cached the headers are reused as long
+        # as the size and modification time of the file did not change.
+        f = None
+        entry = self._metadata_cache.get(key)
+        if entry is not None and entry[0] > time():
+            real_filename, file_loader = entry[1:3]
+            if file_loader is None:
+                return None, None, None, None
+            try:
+                f, mtime, file_size = file_loader()
+            except (IOError, OSError):
+                entry = None
+            else:
+                if (mtime, file_size) != entry[3:5]:
+                    entry = None
+        else:
+            entry = None
+
+        if f is None:
+            real_filename, file_loader = self._find_file(path)
+            if file_loader is None or not self.is_allowed(real_filename):
+                self._metadata_cache.pop(key, None)
+                return None, None, None, None
+            f, mtime, file_size = file_loader()
+
+        if entry is None:
+            entry = self._make_metadata_entry(real_filename, file_loader,
+                                              mtime, file_size, encoding)
+            self._cache_metadata(key, entry)
+        return f, mtime, file_size, entry
+
+    def _cache_metadata(self, key, entry):
+        """Stores an entry in the metadata cache if `metadata_cache_timeout`
+        is set.  If the cache is full the expired entries are removed first
+        and if that is not enough the quarter of the entries that expire
+        next.
+        """
+        if not self.metadata_cache_timeout:
+            return
+        cache = self._metadata_cache
+        if key not in cache and len(cache) >= self.metadata_cache_size:
+            now = time()
+            for old_key, old_entry in cache.items():
+                if old_entry[0] <= now:
+                    del cache[old_key]
+            if len(cache) >= self.metadata_cache_size:
+                items = sorted(cache.items(), key=lambda x: x[1][0])
+                for old_key, old_entry in items[:len(items) // 4 + 1]:
+                    del cache[old_key]
+        cache[key] = entry
+
+    def _has_gzip_variant(self, path, entry):
+        """Checks if a gzip compressed variant of a file exists or can be
+        created.  Whether there is a precompressed file is remembered in the
+        metadata cache for the path and the ``'gzip'`` encoding.
+        """
+        if self._can_compress(entry):
+            return True
+        key = (path, 'gzip')
+        cached = self._metadata_cache.get(key)
+        if cached is not None and cached[0] > time():
+            return cached[2] is not None
+        f = self._open_file(path, 'gzip')[0]
+        if f is not None:
+            f.close()
+            return True
+        self._cache_metadata(key, (time() +
+            (self.metadata_cache_timeout or 0),) + (None,) * 6)
+        return False
+
+    def _can_compress(self, entry):
+        """Checks if the file of a metadata cache entry is compressed on the
+        fly.  Files larger than the whole gzip cache are never compressed.
+        """
+        file_size = entry[4]
+        return self.gzip_cache_dir is not None and \
+               0 < file_size <= self.gzip_cache_size and \
+               self.is_compressible(entry[1])
+
+    def is_compressible(self, filename):
+        """Checks if a file is compressed on the fly if `gzip_cache_dir` is
+        set.  By default this checks the guessed mimetype of the file
+        against the `gzip_mimetypes` rules.
+        """
+        mime_type = mimetypes.guess_type(filename)[0] or \
+                    self.fallback_mimetype
+        for rule in self.gzip_mimetypes:
+            if fnmatch(mime_type, rule):
+                return True
+        return False
+
+    def _compress_file(self, path, f, entry):
+        """Returns a compressed copy of an opened file from the gzip cache
+        in the same form as :meth:`_open_file`.  If there is no compressed
+        copy of this version of the file yet it's created first.  If the
+        file cannot be compressed the original one is returned.
+
+        The entry of the compressed file is cached for the path and the
+        ``'gzip'`` encoding.  It has no `file_loader` but the name of the
+        compressed file as `real_filename` and the modification time and
+        size of the original file.
+        """
+        key = (path, 'gzip')
+        mtime, file_size = entry[3:5]
+        cached = self._metadata_cache.get(key)
+        if cached is not None and cached[0] > time() and \
+           cached[1] is not None and cached[3:5] == (mtime, file_size):
+            try:
+                compressed = open(cached[1], 'rb')
+            except IOError:
+                pass
+            else:
+                f.close()
+                return compressed, mtime, \
+                       int(os.fstat(compressed.fileno()).st_size), cached
+
+        filename = os.path.join(self.gzip_cache_dir, '%s.gz' % md5(
+            '%s\0%d\0%d' % (path, mktime(mtime.timetuple()), file_size)
+        ).hexdigest())
+        try:
+            if not os.path.isfile(filename):
+                self._write_compressed_file(f, filename)
+            compressed = open(filename, 'rb')
+        except (IOError, OSError):
+            f.seek(0)
+            return f, mtime, file_size, entry
+        f.close()
+
+        compressed_size = int(os.fstat(compressed.fileno()).st_size)
+        etag, headers = entry[5:]
+        headers = list(headers)
+        for idx, (header, value) in enumerate(headers):
+            if header == 'Content-Length':
+                headers[idx] = (header, str(compressed_size))
+        if etag is not None:
+            etag += '-gzip'
+            headers[0] = ('Etag', '"%s"' % etag)
+        headers.append(('Content-Encoding', 'gzip'))
+        entry = (time() + (self.metadata_cache_timeout or 0), filename, None,
+                 mtime, file_size, etag, headers)
+        self._cache_metadata(key, entry)
+        return compressed, mtime, compressed_size, entry
+
+    def _write_compressed_file(self, f, filename):
+        """Compresses an opened file into the gzip cache.  The file is
+        written to a temporary file first and renamed afterwards so that
+        other requests never see partial files.  If the gzip cache is larger
+        than `gzip_cache_size` afterwards the oldest files except the new
+        one are removed.
+        """
+        fd, tmp_filename = mkstemp(dir=self.gzip_cache_dir)
+        try:
+            out = os.fdopen(fd, 'wb')
+            try:
+                gzip_file = GzipFile(None, 'wb', 9, out)
+                while 1:
+                    chunk = f.read(16384)
+                    if not chunk:
+                        break
+                    gzip_file.write(chunk)
+                gzip_file.close()
+            finally:
+                out.close()
+            os.rename(tmp_filename, filename)
+        except:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
+
+        cached = []
+        total_size = 0
+        for name in os.listdir(self.gzip_cache_dir):
+            if not name.endswith('.gz'):
+                continue
+            cached_filename = os.path.join(self.gzip_cache_dir, name)
+            if cached_filename == filename:
+                continue
+            try:
+                stat = os.stat(cached_filename)
+            except OSError:
+                continue
+            cached.append((stat.st_mtime, cached_filename, stat.st_size))
+            total_size += stat.st_size
+        total_size += os.path.getsize(filename)
+        cached.sort()
+        for _, cached_filename, size in cached:
+            if total_size <= self.gzip_cache_size:
+                break
+            try:
+                os.remove(cached_filename)
+            except OSError:
+                pass
+            total_size -= size
+
+    def _make_metadata_entry(self, real_filename, file_loader, mtime,
+                             file_size, encoding=None):
+        """Creates the metadata cache entry for a file.  It's a tuple in the
+        form ``(expires, real_filename, file_loader, mtime, file_size, etag,
+        headers)`` where `headers` are the headers that do not change
+        between requests.
+        """
         guessed_type = mimetypes.guess_type(real_filename)
         mime_type = guessed_type[0] or self.fallback_mimetype
-        f, mtime, file_size = file_loader()
-
-        headers = [('Date', http_date())]
+        etag = None
         if self.cache:
-            timeout = self.cache_timeout
             etag = self.generate_etag(mtime, file_size, real_filename)
-            headers += [
+            headers = [
                 ('Etag', '"%s"' % etag),
-                ('Cache-Control', 'max-age=%d, public' % timeout)
+                ('Cache-Control', 'max-age=%d, public' % self.cache_timeout)
             ]
-            if not is_resource_modified(environ, etag, last_modified=mtime):
-                f.close()
-                start_response('304 Not Modified', headers)
-                return []
-            headers.append(('Expires', http_date(time() + timeout)))
         else:
-            headers.append(('Cache-Control', 'public'))
-
+            headers = [('Cache-Control', 'public')]
         headers.extend((
             ('Content-Type', mime_type),
             ('Content-Length', str(file_size)),
             ('Last-Modified', http_date(mtime))
         ))
-        start_response('200 OK', headers)
-        return wrap_file(environ, f)
+        if file_size:
+            headers.append(('Accept-Ranges', 'bytes'))
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+            headers.append(('Vary', 'Accept-Encoding'))
+        expires = time() + (self.metadata_cache_timeout or 0)
+        return expires, real_filename, file_loader, mtime, file_size, \
+               etag, headers
 
 
 class DispatcherMiddleware(object):
@@ -579,6 +930,91 @@ class FileWrapper(object):
         raise StopIteration()
 
 
+class _FileRange(object):
+    """A view on `length` bytes of a file from its current position.  The
+    file descriptor is exposed so that a server can send the range with
+    `sendfile` as well.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if not size:
+            return ''
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+
+def wrap_file_ranges(environ, file, ranges, length, content_type,
+                     buffer_size=8192):
+    """Wraps the given ranges of a seekable file for a
+    ``206 Partial Content`` response.  Returns a tuple in the form
+    ``(app_iter, headers)`` where `headers` is a list of the
+    `Content-Type`, `Content-Length` and `Content-Range` headers to send
+    instead of the headers for the whole file.  A single range is passed to
+    :func:`wrap_file`, multiple ranges are sent as ``multipart/byteranges``.
+    Only the requested ranges are read from the file.
+
+    .. versionadded:: 0.6
+
+    :param file: a seekable :class:`file`-like object.
+    :param ranges: a list of ``(start, stop)`` tuples as returned by
+                   :func:`get_requested_ranges`.
+    :param length: the length of the whole file.
+    :param content_type: the content type of the file.
+    :param buffer_size: number of bytes for one iteration.
+    """
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        file.seek(start)
+        return wrap_file(environ, _FileRange(file, stop - start),
+                         buffer_size), [
+            ('Content-Type', content_type),
+            ('Content-Length', str(stop - start)),
+            ('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, length))
+        ]
+
+    boundary = 'WerkzeugByteRanges_%s%s' % (time(), random())
+    parts = []
+    total_length = len(boundary) + 6
+    for start, stop in ranges:
+        head = '--%s\r\nContent-Type: %s\r\nContent-Range: ' \
+               'bytes %d-%d/%d\r\n\r\n' % (boundary, content_type, start,
+                                           stop - 1, length)
+        parts.append((head, start, stop))
+        total_length += len(head) + stop - start + 2
+
+    def iter_parts():
+        for head, start, stop in parts:
+            yield head
+            file.seek(start)
+            for data in FileWrapper(_FileRange(file, stop - start),
+                                    buffer_size):
+                yield data
+            yield '\r\n'
+        yield '--%s--\r\n' % boundary
+
+    return ClosingIterator(iter_parts(), file.close), [
+        ('Content-Type', 'multipart/byteranges; boundary=' + boundary),
+        ('Content-Length', str(total_length))
+    ]
+
+
 def make_line_iter(stream, limit=None, buffer_size=10 * 1024):
     """Savely iterates line-based over an input stream.  If the input stream
     is not a :class:`LimitedStream` the `limit` parameter is mandatory.
@@ -776,4 +1212,5 @@ class LimitedStream(object):
 
 # circulear dependencies
 from werkzeug.utils import http_date
-from werkzeug.http import is_resource_modified
+from werkzeug.http import is_resource_modified, get_requested_ranges, \
+     parse_accept_header